@@ -0,0 +1,212 @@
+""" Batch runner that solves many CSP and A* instances across a pool of worker processes """
+# python batch_runner.py part-2-search/ASTAR-calls.sh part-1-CSP/CSP-calls.sh --workers 4 --timeout 60
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import shlex
+import signal
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "part-1-CSP"))
+sys.path.insert(0, os.path.join(ROOT, "part-2-search"))
+
+import ASTARStowage  # noqa: E402
+import CSPStowage  # noqa: E402
+
+# solver modules by name, each one provides build_parser() and run(args)
+SOLVERS = {"astar": ASTARStowage, "csp": CSPStowage}
+
+# scripts of the shell calls that can be read as manifest lines
+SCRIPTS = {"ASTARStowage.sh": "astar", "ASTARStowage.py": "astar", "CSPStowage.py": "csp"}
+
+SUMMARY_FIELDS = ["solver", "path", "map", "containers", "heuristic", "options", "status", "wall_time", "time",
+                  "found", "cost", "plan_length", "expanded_nodes", "peak_nodes", "bound", "solutions", "peak_memory",
+                  "cache", "error"]
+
+
+class InstanceTimeout(Exception):
+    """ Raised in a worker when an instance exceeds its time limit """
+
+
+def engine(options):
+    """ Returns the search engine of the options of an A* instance, as its parser reads them, None by default """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--engine")
+    return parser.parse_known_args(options)[0].engine
+
+
+def parse_manifest(manifest_path):
+    """ Returns the instances of a manifest file, one per line as "<solver> <path> <map> <containers> [args...]",
+    where solver is astar or csp. The lines of the calls scripts (ASTAR-calls.sh, CSP-calls.sh) are also accepted.
+    Relative paths are taken from the directory of the manifest """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    instances = []
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            tokens = shlex.split(line, comments=True)
+            if not tokens:
+                continue
+
+            # drop the interpreter of the shell calls
+            if tokens[0].startswith("python"):
+                tokens = tokens[1:]
+            solver = SCRIPTS.get(os.path.basename(tokens[0]), tokens[0])
+            if solver not in SOLVERS or len(tokens) < 4:
+                raise Exception("Wrong manifest line %d in %s: %s" % (line_number, manifest_path, line.strip()))
+
+            if solver == "astar" and engine(tokens[4:]) == "parallel":
+                # the workers of the pool are daemonic and cannot start the processes of the parallel engine
+                raise Exception("The parallel engine cannot run in the batch workers, manifest line %d in %s: %s"
+                                % (line_number, manifest_path, line.strip()))
+            args = [os.path.normpath(os.path.join(base, tokens[1]))] + tokens[2:]
+            instances.append({"solver": solver, "args": args})
+    return instances
+
+
+def glob_instances(solver, tests_path, heuristics):
+    """ Returns the instances of every map × containers combination in a tests directory, for every heuristic when
+    the solver is astar """
+    maps = sorted(os.path.basename(f)[:-4] for f in glob.glob(os.path.join(tests_path, "map*.txt")))
+    containers = sorted(os.path.basename(f)[:-4] for f in glob.glob(os.path.join(tests_path, "containers*.txt")))
+    instances = []
+    for map_name in maps:
+        for containers_name in containers:
+            if solver == "astar":
+                for heuristic in heuristics:
+                    instances.append({"solver": solver, "args": [tests_path, map_name, containers_name, heuristic]})
+            else:
+                instances.append({"solver": solver, "args": [tests_path, map_name, containers_name]})
+    return instances
+
+
+def _raise_timeout(signum, frame):
+    """ Signal handler of the instance time limit """
+    raise InstanceTimeout()
+
+
+def init_worker(memory_mb):
+    """ Initializes a worker process: handler of the time limit and cap of its address space """
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_instance(instance, timeout=None):
+    """ Solves an instance in the worker, writing its usual output files. Returns the summary of the run with its
+    status: ok, timeout, memory or error """
+    module = SOLVERS[instance["solver"]]
+    result = {"solver": instance["solver"], "path": instance["args"][0], "map": instance["args"][1],
+              "containers": instance["args"][2], "status": "ok"}
+    if instance["solver"] == "astar":
+        result["heuristic"] = instance["args"][3]
+        result["options"] = " ".join(instance["args"][4:])
+    else:
+        result["options"] = " ".join(instance["args"][3:])
+
+    start_t = time.time()
+    summary = None
+    try:
+        try:
+            if timeout:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            summary = module.run(module.build_parser().parse_args(instance["args"]))
+        finally:
+            # cleared as soon as the solver returns, any time limit signal is raised before leaving this block
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except InstanceTimeout:
+        # a time limit expiring once the solver has returned does not discard its result
+        if summary is None:
+            result["status"] = "timeout"
+    except MemoryError:
+        result["status"] = "memory"
+    except (Exception, SystemExit) as ex:
+        result["status"] = "error"
+        result["error"] = str(ex)
+    if summary is not None:
+        result.update(summary)
+    result["wall_time"] = (time.time() - start_t)*1000
+    # peak resident memory of the worker in MB, the one of the instance when workers run a single instance
+    result["peak_memory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def _run_instance(task):
+    """ Unpacks the task of the pool, returning the result along with the index of the instance """
+    return task[0], run_instance(*task[1:])
+
+
+def run_batch(instances, workers=None, timeout=None, memory_mb=None, progress=None, fresh_workers=False):
+    """ Solves the instances across a pool of worker processes, which import the solvers once. With fresh_workers,
+    every instance runs in a new worker, so its peak memory is measured on its own. Returns the list of results in
+    the order of the instances """
+    results = [None] * len(instances)
+    tasks = [(i, instance, timeout) for i, instance in enumerate(instances)]
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(memory_mb,),
+                              maxtasksperchild=1 if fresh_workers else None) as pool:
+        for done, (i, result) in enumerate(pool.imap_unordered(_run_instance, tasks)):
+            results[i] = result
+            if progress is not None:
+                progress(done, result)
+    return results
+
+
+def save_summary(results, prefix):
+    """ Writes the consolidated summary of the results as prefix.csv and prefix.json """
+    with open(prefix + ".csv", "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    with open(prefix + ".json", "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solves many CSP and A* instances in parallel")
+    parser.add_argument("manifests", nargs="*", help="manifest files, one instance per line (the *-calls.sh scripts "
+                                                     "are valid manifests)")
+    parser.add_argument("--astar-tests", action="append", default=[],
+                        help="directory whose map × containers combinations are solved with A*")
+    parser.add_argument("--csp-tests", action="append", default=[],
+                        help="directory whose map × containers combinations are solved with the CSP")
+    parser.add_argument("--heuristics", default="heuristic_2",
+                        help="comma separated heuristics of the A* instances of --astar-tests (default heuristic_2)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default the number of CPUs)")
+    parser.add_argument("--timeout", type=float, help="time limit of each instance in seconds")
+    parser.add_argument("--memory", type=int, help="memory limit of each worker process in MB")
+    parser.add_argument("--summary", default="batch-summary",
+                        help="prefix of the summary files, .csv and .json are appended (default batch-summary)")
+    parser.add_argument("--cache", help="SQLite result cache shared by all the instances, see --cache of the solvers")
+    args = parser.parse_args()
+
+    instances = []
+    for manifest in args.manifests:
+        instances.extend(parse_manifest(manifest))
+    for tests_path in args.astar_tests:
+        instances.extend(glob_instances("astar", tests_path, args.heuristics.split(",")))
+    for tests_path in args.csp_tests:
+        instances.extend(glob_instances("csp", tests_path, []))
+    if not instances:
+        parser.error("no instances to solve")
+    if args.cache:
+        for instance in instances:
+            instance["args"] = instance["args"] + ["--cache", os.path.abspath(args.cache)]
+
+    def progress(i, result):
+        print("[%d/%d] %s %s %s %s: %s (%d ms)" % (i + 1, len(instances), result["solver"], result["map"],
+                                                   result["containers"], result.get("heuristic", ""),
+                                                   result["status"], result["wall_time"]))
+
+    results = run_batch(instances, args.workers, args.timeout, args.memory, progress)
+    save_summary(results, args.summary)
+
+
+if __name__ == "__main__":
+    main()
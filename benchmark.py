@@ -0,0 +1,230 @@
+""" Benchmark suite of both solvers over synthetic bay maps and container lists of growing size """
+# python benchmark.py --seed 7 --save-baseline benchmark-baseline.json
+# python benchmark.py --seed 7 --baseline benchmark-baseline.json
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+import batch_runner
+
+# default size sweep as (stacks, depth, containers)
+DEFAULT_SIZES = "2x3:2,3x3:3,3x4:4,3x4:5,4x4:6,4x5:7,5x5:8"
+FLOOR_PROFILES = ("flat", "random", "valley")
+
+
+def generate_map(rng, stacks, depth, floor=1, profile="flat", electrified=0.25):
+    """ Returns the rows of a bay map with the stacks and depth given. The X cells at the bottom of each stack follow
+    the floor profile: flat (floor X cells in every stack), random (between 0 and floor) or valley (floor X cells at
+    both sides down to none in the middle). The electrified fraction of the usable cells are E cells """
+    if profile == "flat":
+        floors = [floor] * stacks
+    elif profile == "random":
+        floors = [rng.randint(0, floor) for _ in range(stacks)]
+    else:
+        middle = (stacks - 1) / 2
+        floors = [round(floor * abs(k - middle) / middle) if middle else 0 for k in range(stacks)]
+    # keep at least one usable cell in each stack
+    floors = [min(f, depth - 1) for f in floors]
+
+    usable = [(row, k) for k in range(stacks) for row in range(depth - floors[k])]
+    e_cells = set(rng.sample(usable, round(electrified * len(usable))))
+
+    rows = []
+    for row in range(depth):
+        cells = []
+        for k in range(stacks):
+            if row >= depth - floors[k]:
+                cells.append("X")
+            else:
+                cells.append("E" if (row, k) in e_cells else "N")
+        rows.append(" ".join(cells))
+    return rows
+
+
+def generate_containers(rng, count, refrigerated=0.25, destinations=None, max_refrigerated=None):
+    """ Returns the lines of a container list: count containers, the refrigerated fraction of them (at most
+    max_refrigerated) and destinations drawn from the {port: weight} mix (ports 1 and 2 evenly by default) """
+    destinations = destinations or {1: 1.0, 2: 1.0}
+    n_refrigerated = round(refrigerated * count)
+    if max_refrigerated is not None:
+        n_refrigerated = min(n_refrigerated, max_refrigerated)
+    types = ["R"] * n_refrigerated + ["S"] * (count - n_refrigerated)
+    rng.shuffle(types)
+
+    ports = list(destinations)
+    weights = [destinations[p] for p in ports]
+    return ["%d %s %d" % (i + 1, types[i], rng.choices(ports, weights)[0]) for i in range(count)]
+
+
+def parse_sizes(sizes):
+    """ Parses a size sweep "STACKSxDEPTH:CONTAINERS,..." into a list of (stacks, depth, containers) """
+    sweep = []
+    for size in sizes.split(","):
+        shape, containers = size.split(":")
+        stacks, depth = shape.lower().split("x")
+        sweep.append((int(stacks), int(depth), int(containers)))
+    return sweep
+
+
+def parse_destinations(destinations):
+    """ Parses a destination mix "PORT:WEIGHT,..." into a {port: weight} dict """
+    mix = {}
+    for item in destinations.split(","):
+        port, weight = item.split(":")
+        mix[int(port)] = float(weight)
+    return mix
+
+
+def write_instances(directory, seed, sweep, floor, profile, electrified, refrigerated, destinations):
+    """ Generates the map and containers files of every size of the sweep into directory, each one from its own seeded
+    generator so that a size does not depend on the others. Returns the list of (label, map name, containers name) """
+    generated = []
+    for stacks, depth, count in sweep:
+        label = "%dx%d-%d" % (stacks, depth, count)
+        rng = random.Random("%s-%s" % (seed, label))
+        rows = generate_map(rng, stacks, depth, floor, profile, electrified)
+        usable = sum(row.count("N") + row.count("E") for row in rows)
+        electrified_cells = sum(row.count("E") for row in rows)
+        lines = generate_containers(rng, min(count, usable), refrigerated, destinations, electrified_cells)
+
+        map_name, containers_name = "map-" + label, "containers-" + label
+        with open(os.path.join(directory, map_name + ".txt"), "w", encoding="utf-8") as file:
+            file.write("\n".join(rows) + "\n")
+        with open(os.path.join(directory, containers_name + ".txt"), "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        generated.append((label, map_name, containers_name))
+    return generated
+
+
+def run_benchmark(directory, generated, heuristics, solvers, workers, timeout, memory_mb):
+    """ Runs the solvers on the generated instances, each one in a fresh worker to measure its peak memory. Returns
+    the list of results, labelled with the size of the instance """
+    instances = []
+    labels = []
+    for label, map_name, containers_name in generated:
+        if "csp" in solvers:
+            instances.append({"solver": "csp", "args": [directory, map_name, containers_name]})
+            labels.append(label)
+        if "astar" in solvers:
+            for heuristic in heuristics:
+                instances.append({"solver": "astar", "args": [directory, map_name, containers_name, heuristic]})
+                labels.append(label)
+
+    results = batch_runner.run_batch(instances, workers, timeout, memory_mb, fresh_workers=True)
+    for label, result in zip(labels, results):
+        result["size"] = label
+    return results
+
+
+def result_key(result):
+    """ Returns the key identifying a result across runs """
+    return "%s %s %s" % (result["size"], result["solver"], result.get("heuristic") or "")
+
+
+def compare(results, baseline, tolerance, min_time=50):
+    """ Compares the results with the baseline ones. The status, cost and number of solutions must not change, and
+    the expanded nodes must not grow; the time may not grow over tolerance times the baseline one, unless it grows
+    less than min_time ms (the times of small instances are mostly noise). Returns the list of regressions as text
+    lines """
+    baseline = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        old = baseline.get(key)
+        if old is None:
+            continue
+        if result["status"] != old["status"]:
+            regressions.append("%s: status %s -> %s" % (key, old["status"], result["status"]))
+            continue
+        for field in ("found", "cost", "solutions"):
+            if result.get(field) != old.get(field):
+                regressions.append("%s: %s %s -> %s" % (key, field, old.get(field), result.get(field)))
+        if result.get("expanded_nodes") is not None and old.get("expanded_nodes") is not None \
+                and result["expanded_nodes"] > old["expanded_nodes"]:
+            regressions.append("%s: expanded nodes %d -> %d" % (key, old["expanded_nodes"], result["expanded_nodes"]))
+        if result["status"] == "ok" and result["time"] > tolerance * old["time"] \
+                and result["time"] - old["time"] > min_time:
+            regressions.append("%s: time %.1f ms -> %.1f ms" % (key, old["time"], result["time"]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """ Prints the table of results, with the baseline time and expanded nodes when given """
+    baseline = {result_key(result): result for result in baseline or []}
+    print("%-10s %-6s %-12s %-8s %10s %10s %10s %10s %12s" % ("size", "solver", "heuristic", "status", "time ms",
+                                                             "expanded", "memory MB", "cost", "solutions"))
+    for result in results:
+        old = baseline.get(result_key(result), {})
+        time_ms = "%.1f" % result["time"] if "time" in result else "-"
+        if "time" in old and "time" in result:
+            time_ms += " (%.2fx)" % (result["time"] / max(old["time"], 1e-3))
+        print("%-10s %-6s %-12s %-8s %10s %10s %10.1f %10s %12s" % (
+            result["size"], result["solver"], result.get("heuristic") or "", result["status"], time_ms,
+            result.get("expanded_nodes", "-"), result["peak_memory"], result.get("cost", "-"),
+            result.get("solutions", "-")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the CSP and A* solvers on synthetic instances")
+    parser.add_argument("--seed", default="0", help="seed of the generators (default 0)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="size sweep as STACKSxDEPTH:CONTAINERS,... (default %s)" % DEFAULT_SIZES)
+    parser.add_argument("--floor", type=int, default=1, help="X cells at the bottom of the stacks (default 1)")
+    parser.add_argument("--floor-profile", choices=FLOOR_PROFILES, default="flat",
+                        help="profile of the X cells along the stacks (default flat)")
+    parser.add_argument("--electrified", type=float, default=0.25,
+                        help="fraction of usable cells that are E cells (default 0.25)")
+    parser.add_argument("--refrigerated", type=float, default=0.25,
+                        help="fraction of refrigerated containers (default 0.25)")
+    parser.add_argument("--destinations", default="1:1,2:1",
+                        help="destination mix as PORT:WEIGHT,... (default 1:1,2:1)")
+    parser.add_argument("--solvers", default="csp,astar", help="comma separated solvers (default csp,astar)")
+    parser.add_argument("--heuristics", default="heuristic_2,heuristic_3",
+                        help="comma separated A* heuristics (default heuristic_2,heuristic_3)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes, more than one makes times noisier (default 1)")
+    parser.add_argument("--timeout", type=float, default=60, help="time limit of each run in seconds (default 60)")
+    parser.add_argument("--memory", type=int, help="memory limit of each run in MB")
+    parser.add_argument("--out", help="directory of the generated instances and outputs (default a temporary one)")
+    parser.add_argument("--results", help="file where the results are saved as JSON")
+    parser.add_argument("--save-baseline", help="file where the results are saved as the new baseline")
+    parser.add_argument("--baseline", help="baseline file to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="time ratio over the baseline reported as a regression (default 1.5)")
+    parser.add_argument("--min-time", type=float, default=50,
+                        help="time increase in ms below which no time regression is reported (default 50)")
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.out or tempfile.mkdtemp(prefix="stowage-bench-"))
+    os.makedirs(directory, exist_ok=True)
+
+    generated = write_instances(directory, args.seed, parse_sizes(args.sizes), args.floor, args.floor_profile,
+                                args.electrified, args.refrigerated, parse_destinations(args.destinations))
+    results = run_benchmark(directory, generated, args.heuristics.split(","), args.solvers.split(","), args.workers,
+                            args.timeout, args.memory)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+    print("Instances in " + directory)
+    print_results(results, baseline)
+
+    for path in (args.results, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=1)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.min_time)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,240 @@
 """ Python file to solve the csp stowage problem given a map and a list of containers"""
 # CSPStowage.py \CSP-tests map1.txt containers1.txt
+import argparse
+import gzip
+import itertools
+import json
+import math
+import os
+import shutil
 import sys
+import tempfile
+import time
+from array import array
 from constraint import *
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import result_cache  # noqa: E402
+import stowage_model  # noqa: E402
+
+SOLVERS = ("stack", "constraint")
+# version of the results kept by the result cache, bumped whenever the solutions or the output file can change
+RESULT_VERSION = 1
+
+# formats of the solutions and the suffix of their file: text lines of the solutions after their number, JSON lines of
+# the solutions, or a binary dump of the cell of every container in every solution
+OUTPUT_FORMATS = {"text": ".output", "jsonl": ".jsonl", "binary": ".bin"}
+# solutions buffered by the binary format between writes
+BINARY_CHUNK = 4096
+
+
+class BayGeometry:
+    """ Indexed bay map: the sets of cells and, for every usable cell, the cells below and above it """
+    __slots__ = ("cells", "electrified", "blocked", "depth", "below", "above", "floor")
+
+    def __init__(self, domain_standard, domain_refrigerator, domain_x, depth):
+        self.cells = frozenset(domain_standard)
+        self.electrified = frozenset(domain_refrigerator)
+        self.blocked = frozenset(domain_x)
+        self.depth = depth
+        # cell -> cell that must hold a container for the cell to be used, None when it is above an X or the floor
+        self.below = {}
+        # cell -> usable cell above it, None at the top of the map or under an X
+        self.above = {}
+        # cells above an X or the floor, where the stacks start
+        self.floor = []
+        for cell in domain_standard:
+            cell_below = (cell[0] + 1, cell[1])
+            if cell_below in self.blocked or cell[0] == depth - 1:
+                self.below[cell] = None
+                self.floor.append(cell)
+            else:
+                self.below[cell] = cell_below
+            cell_above = (cell[0] - 1, cell[1])
+            self.above[cell] = cell_above if cell_above in self.cells else None
+
 
 def parser_map(map_path):
     """ Function parsers map txt file """
-    try:
-        with open(map_path, "r", encoding="utf-8", newline="") as file:
-            data = file.readlines()
-    except FileNotFoundError as ex:
-        raise Exception("Wrong path or file path") from ex
-
-    domain_standard = []
-    domain_refrigerator = []
-    domain_x = []
-
-    counter_row = 0
-    for line in data:
-        counter_column = 0
-        for c in line:
-            if c == "N":
-                domain_standard.append((counter_row, counter_column))
-                counter_column += 1
-            elif c == "E":
-                domain_refrigerator.append((counter_row, counter_column))
-                domain_standard.append((counter_row, counter_column))
-                counter_column += 1
-            elif c == "X":
-                domain_x.append((counter_row, counter_column))
-                counter_column += 1
-        counter_row += 1
-
-    return domain_standard, domain_refrigerator, domain_x, counter_row
+    bay = stowage_model.load_bay(map_path)
+
+    domain_standard = list(bay.usable)
+    domain_refrigerator = [cell for cell in bay.usable if cell in bay.electrified]
+    domain_x = [(row, column) for row, column, kind in bay.cells if kind == stowage_model.BLOCKED]
+
+    geometry = BayGeometry(domain_standard, domain_refrigerator, domain_x, bay.depth)
+
+    return domain_standard, domain_refrigerator, domain_x, bay.depth, geometry
 
 
 def parse_containers(containers_path):
     """ Function to parse the containers file """
-    try:
-        with open(containers_path, "r", encoding="utf-8", newline="") as file:
-            data = file.readlines()
-    except FileNotFoundError as ex:
-        raise Exception("Wrong path or file path") from ex
+    manifest = stowage_model.load_manifest(containers_path)
 
     containers_standard = []
     containers_refrigerated = []
     containers = []
     containers_destination = []
 
-    for line in data:
-        c = line.split()
-        if c[1] == "S":
-            containers_standard.append(c[0])
+    for container_id, refrigerated, destination in manifest.containers:
+        if refrigerated:
+            containers_refrigerated.append(str(container_id))
         else:
-            containers_refrigerated.append(c[0])
-        containers.append(c[0])
-        containers_destination.append(c[2])
+            containers_standard.append(str(container_id))
+        containers.append(str(container_id))
+        containers_destination.append(str(destination))
 
     return containers, containers_destination, containers_standard, containers_refrigerated
 
 
-def save_output(solution, path, map_name, container_map):
-    """Save the output on a txt file"""
-    file = open(path + "/" + map_name + "-" + container_map + ".output", "w+")
-    file.truncate()
-    file.write("Number of solutions: %d\n" % len(solution))
+def output_path(path, map_name, container_map, output_format="text", compress=False):
+    """ Returns the path of the output file """
+    return path + "/" + map_name + "-" + container_map + OUTPUT_FORMATS[output_format] + (".gz" if compress else "")
 
-    for s in solution:
-        file.write(str(s) + "\n")
 
+def save_count(count, path, map_name, container_map):
+    """ Saves the number of solutions alone on a txt file """
+    with open(output_path(path, map_name, container_map), "w") as file:
+        file.write("Number of solutions: %d\n" % count)
+
+
+def save_output(solutions, path, map_name, container_map, count_only=False, output_format="text", compress=False,
+                layout=None):
+    """ Saves the solutions as they are produced, none of them is held in memory, and returns their number. The text
+    format writes the number of solutions and then the solutions, streamed through a temporary file until the number
+    is known. The jsonl format writes a JSON object per solution, and the binary format a JSON line with the
+    containers and the cells of the layout (containers, cells) followed by the index of the cell of every container of
+    every solution, one byte each (two when there are more than 256 cells). compress gzips the file on the fly """
+    count = 0
+    if count_only:
+        for _ in solutions:
+            count += 1
+        save_count(count, path, map_name, container_map)
+        return count
+
+    file_path = output_path(path, map_name, container_map, output_format, compress)
+    if output_format == "text":
+        with tempfile.TemporaryFile(dir=path) as buffer:
+            stream = gzip.GzipFile(fileobj=buffer, mode="wb") if compress else buffer
+            for s in solutions:
+                stream.write((str(s) + "\n").encode("utf-8"))
+                count += 1
+            if compress:
+                stream.close()
+            buffer.seek(0)
+            with open(file_path, "wb") as file:
+                header = ("Number of solutions: %d\n" % count).encode("utf-8")
+                # a gzip file may hold several members, the compressed solutions follow the header as they are
+                file.write(gzip.compress(header) if compress else header)
+                shutil.copyfileobj(buffer, file)
+        return count
+
+    with gzip.open(file_path, "wb") if compress else open(file_path, "wb") as file:
+        if output_format == "jsonl":
+            for s in solutions:
+                file.write((json.dumps(s, separators=(",", ":")) + "\n").encode("utf-8"))
+                count += 1
+        else:
+            containers, cells = layout
+            cell_index = {cell: i for i, cell in enumerate(cells)}
+            typecode = "B" if len(cells) <= 256 else "H"
+            file.write((json.dumps({"containers": containers, "cells": cells, "typecode": typecode}) + "\n")
+                       .encode("utf-8"))
+            chunk = array(typecode)
+            for s in solutions:
+                chunk.extend(cell_index[s[c]] for c in containers)
+                count += 1
+                if count % BINARY_CHUNK == 0:
+                    chunk.tofile(file)
+                    del chunk[:]
+            chunk.tofile(file)
+    return count
+
+
+def stack_segments(geometry):
+    """ Returns the runs of cells of the map that are filled from the bottom up, each one from a cell above an X or the
+    floor up to the first X or the top of the map """
+    segments = []
+    for cell in geometry.floor:
+        segment = [cell]
+        while geometry.above[segment[-1]] is not None:
+            segment.append(geometry.above[segment[-1]])
+        segments.append(segment)
+    return segments
 
-if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        raise Exception("Invalid number of arguments")
 
-    test_path = sys.argv[1]
-    map_file = sys.argv[2]
-    containers_file = sys.argv[3]
+def valid_stowage(geometry, assignment, destination, refrigerated):
+    """ Checks a complete stowage given as container -> cell: distinct usable cells, refrigerated containers in E
+    cells, and every container on the floor, an X or a container with a destination not before its own """
+    # cell -> container, built once per check
+    occupant = {}
+    for c, cell in assignment.items():
+        if cell not in geometry.cells or cell in occupant:
+            return False
+        if c in refrigerated and cell not in geometry.electrified:
+            return False
+        occupant[cell] = c
+    for c, cell in assignment.items():
+        below = geometry.below[cell]
+        if below is not None and (below not in occupant or destination[occupant[below]] < destination[c]):
+            return False
+    return True
 
-    domain_standard, domain_refrigerator, domain_x, depth = parser_map(test_path + "/" + map_file + ".txt")
 
-    containers, containers_destination, containers_standard, containers_refrigerated = parse_containers(test_path + "/" + containers_file + ".txt")
+class SupportConstraint(Constraint):
+    """ Constraint that every container is above an X cell, the floor or another container. On partial assignments it
+    fails as soon as the cells that must still be filled below the assigned containers outnumber the unassigned
+    containers or are out of their domains """
 
+    def __init__(self, support):
+        # cell -> cell that must hold a container for the cell to be used, None when it is above an X or the floor
+        self._support = support
+
+    def __call__(self, variables, domains, assignments, forwardcheck=False):
+        occupied = set(assignments.values())
+        unassigned = [v for v in variables if v not in assignments]
+
+        # cells to fill below the assigned containers, down to the first X, floor or occupied cell
+        missing = set()
+        for cell in occupied:
+            below = self._support.get(cell)
+            while below is not None and below not in occupied and below not in missing:
+                missing.add(below)
+                below = self._support.get(below)
+        if not missing:
+            return True
+        if len(missing) > len(unassigned):
+            return False
+        for cell in missing:
+            if not any(cell in domains[v] for v in unassigned):
+                return False
+
+        # as many cells to fill as unassigned containers: these can only go to the missing cells
+        if forwardcheck and len(missing) == len(unassigned):
+            for v in unassigned:
+                domain = domains[v]
+                for value in domain[:]:
+                    if value not in missing:
+                        domain.hideValue(value)
+                if not domain:
+                    return False
+        return True
+
+
+def validated(solutions, geometry, containers, containers_destination, containers_refrigerated):
+    """ Passes the solutions through, raising an exception on the first one that is not a valid stowage of all the
+    containers """
+    destination = {c: int(d) for c, d in zip(containers, containers_destination)}
+    refrigerated = set(containers_refrigerated)
+    for s in solutions:
+        if len(s) != len(containers) or not valid_stowage(geometry, s, destination, refrigerated):
+            raise Exception("Invalid solution: %s" % s)
+        yield s
+
+
+def build_problem(domain_standard, domain_refrigerator, geometry, containers, containers_destination,
+                  containers_standard, containers_refrigerated):
+    """ Returns the constraint problem of stowing the containers in the map """
     problem = Problem()
 
     problem.addVariables(containers_standard, domain_standard)
@@ -91,30 +244,307 @@ if __name__ == "__main__":
     problem.addConstraint(AllDifferentConstraint(), containers)
 
     # check the container is above an X or above another container
-    def on_top(*args):
-        for cell in args:
-            cell_below = (cell[0] + 1, cell[1])
+    problem.addConstraint(SupportConstraint(geometry.below), containers)
 
-            if cell_below not in domain_x and cell_below not in args and cell[0] != depth - 1:
-                return False
-        return True
+    # a container can not be above a container of an earlier port, checked pairwise
+    below = geometry.below
 
-    problem.addConstraint(on_top, containers)
+    def not_above(cell_above, cell_below):
+        return below[cell_above] != cell_below
 
-    def port(*args):
-        for i in range(len(args)):
-            cell = args[i]
-            dest_port_above = containers_destination[i]
-            cell_below = (cell[0] + 1, cell[1])
+    for i in range(len(containers)):
+        for j in range(len(containers)):
+            if int(containers_destination[i]) > int(containers_destination[j]):
+                problem.addConstraint(not_above, (containers[i], containers[j]))
 
-            # if cell below is empty continue
-            if cell_below not in domain_x and cell_below in args:
-                dest_port_below = containers_destination[args.index(cell_below)]
-                if int(dest_port_below) < int(dest_port_above):
-                    return False
-        return True
+    return problem
+
+
+def stack_solutions(segments, domain_refrigerator, containers, containers_destination, containers_refrigerated):
+    """ Generator of the solutions, filling the segments one after another from the bottom up. Every container is
+    placed on the floor, an X or the container below it in the segment, with a destination not after the one below and
+    in an E cell when refrigerated, so only valid stowages are built """
+    electrified = set(domain_refrigerator)
+    refrigerated = set(containers_refrigerated)
+    destination = {c: int(d) for c, d in zip(containers, containers_destination)}
 
-    problem.addConstraint(port, containers)
+    # cells and E cells of each segment from each level up, and of the segments after each one
+    cells_after = [0] * (len(segments) + 1)
+    electrified_after = [0] * (len(segments) + 1)
+    electrified_above = []
+    for s in range(len(segments) - 1, -1, -1):
+        above = [0] * (len(segments[s]) + 1)
+        for level in range(len(segments[s]) - 1, -1, -1):
+            above[level] = above[level + 1] + (segments[s][level] in electrified)
+        electrified_above.insert(0, above)
+        cells_after[s] = cells_after[s + 1] + len(segments[s])
+        electrified_after[s] = electrified_after[s + 1] + above[0]
 
-    save_output(problem.getSolutions(), test_path, map_file, containers_file)
+    placed = {}
 
+    def fill(s, level, dest_below, left, left_refrigerated):
+        if left == 0:
+            yield {c: placed[c] for c in containers}
+            return
+        if s == len(segments):
+            return
+        segment = segments[s]
+        # not enough cells or E cells left for the containers to place
+        if left > len(segment) - level + cells_after[s + 1] or \
+                left_refrigerated > electrified_above[s][level] + electrified_after[s + 1]:
+            return
+
+        if level < len(segment):
+            cell = segment[level]
+            for c in containers:
+                if c in placed or destination[c] > dest_below:
+                    continue
+                is_refrigerated = c in refrigerated
+                if is_refrigerated and cell not in electrified:
+                    continue
+                placed[c] = cell
+                yield from fill(s, level + 1, destination[c], left - 1, left_refrigerated - is_refrigerated)
+                del placed[c]
+
+        # the rest of the segment stays empty
+        yield from fill(s + 1, 0, float("inf"), left, left_refrigerated)
+
+    return fill(0, 0, float("inf"), len(containers), len(refrigerated))
+
+
+def _segment_fills(pattern, classes, multiplicity):
+    """ Returns the number of ways of filling a segment from the bottom up with containers of the classes, by the
+    vector of containers of each class used. pattern tells which cells of the segment are E cells """
+    fills = {}
+    states = {((0,) * len(classes), float("inf")): 1}
+    for electrified in pattern:
+        next_states = {}
+        for (used, dest_below), ways in states.items():
+            # the rest of the segment stays empty
+            fills[used] = fills.get(used, 0) + ways
+            for i, (refrigerated, dest) in enumerate(classes):
+                if dest > dest_below or used[i] == multiplicity[i] or (refrigerated and not electrified):
+                    continue
+                key = (used[:i] + (used[i] + 1,) + used[i + 1:], dest)
+                next_states[key] = next_states.get(key, 0) + ways
+        states = next_states
+    for (used, _), ways in states.items():
+        fills[used] = fills.get(used, 0) + ways
+    return fills
+
+
+def _container_classes(containers, containers_destination, containers_refrigerated):
+    """ Returns the classes of interchangeable containers, as sorted (refrigerated, destination), and the list of
+    containers of each class """
+    refrigerated = set(containers_refrigerated)
+    members = {}
+    for c, d in zip(containers, containers_destination):
+        members.setdefault((c in refrigerated, int(d)), []).append(c)
+    classes = sorted(members)
+    return classes, [members[k] for k in classes]
+
+
+def count_solutions(segments, domain_refrigerator, containers, containers_destination, containers_refrigerated):
+    """ Returns the number of solutions without enumerating them. Containers of the same type and destination are
+    interchangeable, so the solutions are the fills of the segments with classes of containers, counted by dynamic
+    programming over the vectors of containers used, times the orderings of the containers of each class """
+    classes, members = _container_classes(containers, containers_destination, containers_refrigerated)
+    multiplicity = tuple(len(m) for m in members)
+    electrified = set(domain_refrigerator)
+
+    # segments with the same E cells have the same fills
+    fills = {}
+    total = {(0,) * len(classes): 1}
+    for segment in segments:
+        pattern = tuple(cell in electrified for cell in segment)
+        if pattern not in fills:
+            fills[pattern] = _segment_fills(pattern, classes, multiplicity)
+        combined = {}
+        for used, ways in total.items():
+            for fill, fill_ways in fills[pattern].items():
+                vector = tuple(a + b for a, b in zip(used, fill))
+                if all(v <= m for v, m in zip(vector, multiplicity)):
+                    combined[vector] = combined.get(vector, 0) + ways * fill_ways
+        total = combined
+
+    count = total.get(multiplicity, 0)
+    for m in multiplicity:
+        count *= math.factorial(m)
+    return count
+
+
+def _segment_sequences(pattern, classes, multiplicity):
+    """ Returns one way of filling a segment from the bottom up, as the sequence of classes of its containers, for
+    every vector of containers of each class that can fill it. pattern tells which cells of the segment are E cells """
+    sequences = {}
+    states = {((0,) * len(classes), float("inf")): ()}
+    for electrified in pattern:
+        next_states = {}
+        for (used, dest_below), sequence in states.items():
+            sequences.setdefault(used, sequence)
+            for i, (refrigerated, dest) in enumerate(classes):
+                if dest > dest_below or used[i] == multiplicity[i] or (refrigerated and not electrified):
+                    continue
+                next_states.setdefault((used[:i] + (used[i] + 1,) + used[i + 1:], dest), sequence + (i,))
+        states = next_states
+    for (used, _), sequence in states.items():
+        sequences.setdefault(used, sequence)
+    return sequences
+
+
+def cheapest_stowage(segments, domain_refrigerator, containers, containers_destination, containers_refrigerated,
+                     cell_cost):
+    """ Returns the solution (container -> cell) with the lowest sum of cell_cost(cell) over the cells used, None if
+    there is no solution. As the cost of a fill of a segment only depends on its height, the same dynamic programming
+    as count_solutions keeps the cheapest combination of fills for every vector of containers used """
+    classes, members = _container_classes(containers, containers_destination, containers_refrigerated)
+    multiplicity = tuple(len(m) for m in members)
+    electrified = set(domain_refrigerator)
+
+    sequences = {}
+    best = {(0,) * len(classes): 0}
+    # for every segment, vector of containers used -> (vector before the segment, fill of the segment)
+    choices = []
+    for segment in segments:
+        pattern = tuple(cell in electrified for cell in segment)
+        if pattern not in sequences:
+            sequences[pattern] = _segment_sequences(pattern, classes, multiplicity)
+        fill_cost = [0]
+        for cell in segment:
+            fill_cost.append(fill_cost[-1] + cell_cost(cell))
+
+        combined = {}
+        back = {}
+        for used, cost in best.items():
+            for fill, sequence in sequences[pattern].items():
+                vector = tuple(a + b for a, b in zip(used, fill))
+                if any(v > m for v, m in zip(vector, multiplicity)):
+                    continue
+                total = cost + fill_cost[len(sequence)]
+                if vector not in combined or total < combined[vector]:
+                    combined[vector] = total
+                    back[vector] = (used, sequence)
+        best = combined
+        choices.append(back)
+
+    if multiplicity not in best:
+        return None
+    # walk the fills back from the last segment, giving each cell any container left of its class
+    stowage = {}
+    left = [list(m) for m in members]
+    vector = multiplicity
+    for segment, back in zip(reversed(segments), reversed(choices)):
+        vector, sequence = back[vector]
+        for cell, k in zip(segment, sequence):
+            stowage[left[k].pop()] = cell
+    return stowage
+
+
+class StowageParser(argparse.ArgumentParser):
+    """ Parser of the command line arguments that rejects the combinations of options that cannot work together """
+
+    def parse_args(self, args=None, namespace=None):
+        args = super().parse_args(args, namespace)
+        if args.check_count and not (args.count_only and args.solver == "stack" and args.first_n is None):
+            self.error("--check-count needs --count-only with the stack solver and without --first-n")
+        if args.count_only and (args.format != "text" or args.gzip):
+            self.error("--count-only writes the number of solutions as text, without --format or --gzip")
+        return args
+
+
+def build_parser():
+    """ Returns the parser of the command line arguments """
+    parser = StowageParser(description="Validation of the stowage of containers in a ship")
+    parser.add_argument("path", help="directory of the input files, where the output file is written")
+    parser.add_argument("map", help="name of the ship map file, without extension")
+    parser.add_argument("containers", help="name of the containers file, without extension")
+    parser.add_argument("--solver", choices=SOLVERS, default="stack",
+                        help="stack: fills the stacks from the bottom up (default), constraint: python-constraint "
+                             "model")
+    parser.add_argument("--count-only", action="store_true",
+                        help="writes the number of solutions only, counted without enumerating them with the stack "
+                             "solver")
+    parser.add_argument("--check-count", action="store_true",
+                        help="checks the number of solutions of --count-only against their enumeration")
+    parser.add_argument("--validate", action="store_true",
+                        help="checks every solution found against the rules of the stowage")
+    parser.add_argument("--first-n", type=int,
+                        help="stops after the first N solutions, --first-n 1 checks whether the stowage is feasible")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="text",
+                        help="format of the solutions: text, the number of solutions and one solution per line "
+                             "(default), jsonl, one JSON object per solution, or binary, the cell index of every "
+                             "container after a JSON header")
+    parser.add_argument("--gzip", action="store_true", help="compresses the solutions file on the fly")
+    parser.add_argument("--cache", help="SQLite file of the results of previous runs, reused for the same map, "
+                                        "containers and options, with the text format only")
+    parser.add_argument("--cache-size", type=float, default=result_cache.DEFAULT_SIZE,
+                        help="MB after which the least recently used results leave the cache (default %d)"
+                             % result_cache.DEFAULT_SIZE)
+    return parser
+
+
+def run(args):
+    """ Solves the problem given by the parsed arguments and saves the output file. Returns a summary """
+    start_t = time.time()
+
+    domain_standard, domain_refrigerator, domain_x, depth, geometry = parser_map(args.path + "/" + args.map + ".txt")
+
+    containers, containers_destination, containers_standard, containers_refrigerated = parse_containers(args.path + "/" + args.containers + ".txt")
+
+    # a previous run of the same problem and options answers at once
+    cache = None
+    if args.cache and args.format == "text" and not args.gzip:
+        cache = result_cache.ResultCache(args.cache, int(args.cache_size * 1024 * 1024))
+        key = result_cache.cache_key("csp", RESULT_VERSION, domain_standard, domain_refrigerator, domain_x,
+                                     depth, containers, containers_destination, containers_refrigerated,
+                                     {"solver": args.solver, "count_only": args.count_only,
+                                      "check_count": args.check_count, "validate": args.validate,
+                                      "first_n": args.first_n})
+        cached = cache.get(key)
+        if cached is not None:
+            cache.close()
+            summary, files = cached
+            with open(output_path(args.path, args.map, args.containers), "w") as file:
+                file.write(files[".output"])
+            summary.update(time=(time.time() - start_t)*1000, cache="hit")
+            return summary
+
+    segments = stack_segments(geometry)
+    if args.count_only and args.solver == "stack" and args.first_n is None:
+        count = count_solutions(segments, domain_refrigerator, containers, containers_destination,
+                                containers_refrigerated)
+        if args.check_count:
+            enumerated = sum(1 for _ in stack_solutions(segments, domain_refrigerator, containers,
+                                                        containers_destination, containers_refrigerated))
+            if enumerated != count:
+                raise Exception("Wrong number of solutions: %d counted, %d enumerated" % (count, enumerated))
+        save_count(count, args.path, args.map, args.containers)
+    else:
+        if args.solver == "stack":
+            solutions = stack_solutions(segments, domain_refrigerator, containers, containers_destination,
+                                        containers_refrigerated)
+        else:
+            problem = build_problem(domain_standard, domain_refrigerator, geometry, containers,
+                                    containers_destination, containers_standard, containers_refrigerated)
+            solutions = problem.getSolutionIter()
+
+        if args.validate:
+            solutions = validated(solutions, geometry, containers, containers_destination, containers_refrigerated)
+        if args.first_n is not None:
+            solutions = itertools.islice(solutions, args.first_n)
+        count = save_output(solutions, args.path, args.map, args.containers, args.count_only, args.format, args.gzip,
+                            (containers, sorted(geometry.cells)))
+
+    summary = {"time": (time.time() - start_t)*1000, "solutions": count}
+    if cache is not None:
+        # solution sets larger than the whole cache are not kept
+        if os.path.getsize(output_path(args.path, args.map, args.containers)) <= cache.max_bytes:
+            with open(output_path(args.path, args.map, args.containers)) as file:
+                cache.put(key, summary, {".output": file.read()})
+        cache.close()
+        summary["cache"] = "miss"
+    return summary
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,110 @@
+""" Micro-benchmark of the stowage checks: the list based on_top and port constraints against the indexed bay """
+# python constraint_benchmark.py ./CSP-tests map3 containers3 --checks 20000
+import argparse
+import itertools
+import random
+import time
+
+import CSPStowage
+
+
+def list_checks(domain_x, depth, containers, containers_destination):
+    """ Returns the check of a complete stowage with the former whole-tuple constraints, which scan lists for every
+    container: all different, on_top and port """
+
+    def on_top(*args):
+        for cell in args:
+            cell_below = (cell[0] + 1, cell[1])
+
+            if cell_below not in domain_x and cell_below not in args and cell[0] != depth - 1:
+                return False
+        return True
+
+    def port(*args):
+        for i in range(len(args)):
+            cell = args[i]
+            dest_port_above = containers_destination[i]
+            cell_below = (cell[0] + 1, cell[1])
+
+            # if cell below is empty continue
+            if cell_below not in domain_x and cell_below in args:
+                dest_port_below = containers_destination[args.index(cell_below)]
+                if int(dest_port_below) < int(dest_port_above):
+                    return False
+        return True
+
+    def check(assignment):
+        args = [assignment[c] for c in containers]
+        return len(set(args)) == len(args) and on_top(*args) and port(*args)
+
+    return check
+
+
+def indexed_check(geometry, containers, containers_destination, containers_refrigerated):
+    """ Returns the check of a complete stowage on the indexed bay """
+    destination = {c: int(d) for c, d in zip(containers, containers_destination)}
+    refrigerated = set(containers_refrigerated)
+
+    def check(assignment):
+        return CSPStowage.valid_stowage(geometry, assignment, destination, refrigerated)
+
+    return check
+
+
+def sample_assignments(rng, count, solutions, domain_standard, domain_refrigerator, containers_refrigerated):
+    """ Returns count stowages: half of them valid solutions, the other half the same ones with a container moved to
+    another cell of its domain, most of them invalid """
+    refrigerated = set(containers_refrigerated)
+    assignments = []
+    for i in range(count):
+        assignment = dict(solutions[i % len(solutions)])
+        if i % 2:
+            c = rng.choice(list(assignment))
+            assignment[c] = rng.choice(domain_refrigerator if c in refrigerated else domain_standard)
+        assignments.append(assignment)
+    return assignments
+
+
+def throughput(check, assignments):
+    """ Returns the verdicts of the check and the number of checks per second """
+    start_t = time.perf_counter()
+    verdicts = [check(a) for a in assignments]
+    return verdicts, len(assignments) / (time.perf_counter() - start_t)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the stowage checks")
+    parser.add_argument("path", help="directory of the input files")
+    parser.add_argument("map", help="name of the ship map file, without extension")
+    parser.add_argument("containers", help="name of the containers file, without extension")
+    parser.add_argument("--checks", type=int, default=20000, help="number of stowages checked (default 20000)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sample (default 0)")
+    args = parser.parse_args()
+
+    domain_standard, domain_refrigerator, domain_x, depth, geometry = \
+        CSPStowage.parser_map(args.path + "/" + args.map + ".txt")
+    containers, containers_destination, containers_standard, containers_refrigerated = \
+        CSPStowage.parse_containers(args.path + "/" + args.containers + ".txt")
+
+    solutions = list(itertools.islice(CSPStowage.stack_solutions(
+        CSPStowage.stack_segments(geometry), domain_refrigerator, containers, containers_destination,
+        containers_refrigerated), args.checks))
+    if not solutions:
+        raise Exception("The instance has no solutions to sample")
+    assignments = sample_assignments(random.Random(args.seed), args.checks, solutions, domain_standard,
+                                     domain_refrigerator, containers_refrigerated)
+
+    list_verdicts, list_rate = throughput(list_checks(domain_x, depth, containers, containers_destination),
+                                          assignments)
+    indexed_verdicts, indexed_rate = throughput(indexed_check(geometry, containers, containers_destination,
+                                                              containers_refrigerated), assignments)
+    if list_verdicts != indexed_verdicts:
+        raise Exception("The checks disagree")
+
+    print("Stowages checked: %d (%d valid)" % (len(assignments), sum(indexed_verdicts)))
+    print("List constraints: %.0f checks/s" % list_rate)
+    print("Indexed bay: %.0f checks/s (%.1fx)" % (indexed_rate, indexed_rate / list_rate))
+
+
+if __name__ == "__main__":
+    main()
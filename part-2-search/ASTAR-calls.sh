@@ -14,4 +14,6 @@
 ./ASTARStowage.sh ./ASTAR-tests map5 containers5 heuristic_2
 
 ./ASTARStowage.sh ./ASTAR-tests map6 containers5 heuristic_1
-./ASTARStowage.sh ./ASTAR-tests map6 containers5 heuristic_2
\ No newline at end of file
+./ASTARStowage.sh ./ASTAR-tests map6 containers5 heuristic_2
+./ASTARStowage.sh ./ASTAR-tests map6 containers5 heuristic_3
+./ASTARStowage.sh ./ASTAR-tests map6 containers5 heuristic_3 --engine idastar
\ No newline at end of file
@@ -1,35 +1,193 @@
 """ A STAR implementation for transporting containers """
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
+import queue
 import sys
 import time
+import zlib
+from array import array
+
+try:
+    import resource
+except ImportError:
+    # peak memory is not reported where there is no resource module
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# the part 1 model, imported by the decomposed engine only
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part-1-CSP"))
+import result_cache  # noqa: E402
+import stowage_model  # noqa: E402
 
 LOAD_COST = 10
 UNLOAD_COST = 15
 SAIL_COST = 3500
-PORT_LIST = ["0", "1", "2"]
+# ports of the default route, a line 0 - 1 - 2, extended when the containers go further
+DEFAULT_PORTS = 3
+# version of the results kept by the result cache, bumped whenever a plan, its cost or the output files can change
+RESULT_VERSION = 1
+# cross-check every incremental heuristic update against a full computation (debug mode)
+HEURISTIC_CHECK = False
+
+# directory of the pattern database files of heuristic_4, None keeps the tables in memory only
+PATTERN_DIRECTORY = None
+PATTERN_VERSION = 1
+# cost of the abstract states that cannot reach the goal in the pattern database tables
+PATTERN_UNREACHABLE = 0xFFFFFFFF
+# tables of the pattern databases kept across the problems solved by a long running process, by bay shape and pair of
+# container classes, None keeps them for a problem only
+PATTERN_TABLES = None
+
+
+class StowageProblem:
+    """ class holding the static part of the problem, stored once for the whole search: the usable cells of the ship
+    map and the attributes of the containers. A state only encodes the ship current port and the location of every
+    container as an immutable bytes string [ship_port, location_0, location_1, ...], where a location lower than the
+    number of ports is a port and any other value is the index of a ship cell plus the number of ports """
+    def __init__(self, ship_map, list_containers, route=None):
+        # ports and sails of the voyage, with the least number of sails between every pair of ports
+        if route is None:
+            route = stowage_model.line_route(max([DEFAULT_PORTS] + [c[5] + 1 for c in list_containers]))
+        for c in list_containers:
+            if c[5] >= route.n_ports:
+                raise Exception("Destination %d of container %d is not a port of the route" % (c[5], c[0]))
+        self.n_ports = route.n_ports
+        self.sail_ports = route.neighbours
+        self.port_distance = route.distance
+
+        # usable cells (not X) of the ship map as (x, y, electrified)
+        self.cells = [(cell[0], cell[1], cell[2]) for cell in ship_map if not cell[3]]
+        cell_index = {(cell[0], cell[1]): i for i, cell in enumerate(self.cells)}
+        x_cells = {(cell[0], cell[1]) for cell in ship_map if cell[3]}
+
+        # stacks of the ship: runs of usable cells in a column, as cell indexes from their floor (the cell lying on an
+        # X cell or on the lowest level) upwards. The containers of a stack always fill it from its floor, so the
+        # height of a stack is enough to know its only legal load cell and which container can be unloaded
+        self.stacks = []
+        # (stack, level) of every cell
+        self.cell_stack = [None] * len(self.cells)
+        for i, cell in enumerate(self.cells):
+            if (cell[0] + 1, cell[1]) not in cell_index:
+                stack = []
+                below = i
+                while below is not None:
+                    self.cell_stack[below] = (len(self.stacks), len(stack))
+                    stack.append(below)
+                    below = cell_index.get((self.cells[below][0] - 1, cell[1]))
+                self.stacks.append(stack)
+        # a stack whose top cell is right below an X cell cannot unload the container in that cell
+        self.stack_capped = [(self.cells[stack[-1]][0] - 1, self.cells[stack[-1]][1]) in x_cells
+                             for stack in self.stacks]
+
+        # lowest row where a standard (False) and a refrigerated (True) container can be loaded, None if none
+        rows = [cell[0] for cell in self.cells]
+        electrified_rows = [cell[0] for cell in self.cells if cell[2]]
+        self.min_load_row = {False: min(rows, default=None), True: min(electrified_rows, default=None)}
+
+        # containers attributes as (id, refrigerated, destination), the order is the one of the state locations
+        self.containers = [(c[0], c[3], c[5]) for c in list_containers]
+        self.initial_locations = [c[4] for c in list_containers]
+
+        # one byte per location unless the ship has more cells than fit in it
+        self.typecode = "B" if self.n_ports + len(self.cells) <= 256 else "H"
+        # encoding of every location, so that a successor state is sliced from its parent without decoding it
+        self.itemsize = array(self.typecode).itemsize
+        self.location_bytes = [array(self.typecode, [v]).tobytes() for v in range(self.n_ports + len(self.cells))]
+
+        # classes of interchangeable containers (same refrigeration and destination) and groups of interchangeable
+        # stacks (same rows, electrified cells and capping), used to find the canonical key of symmetric states
+        classes = {}
+        self.container_class = [classes.setdefault(c[1:], len(classes)) for c in self.containers]
+        self.n_classes = len(classes)
+        shapes = {}
+        for s, stack in enumerate(self.stacks):
+            shape = (tuple((self.cells[cell][0], self.cells[cell][2]) for cell in stack), self.stack_capped[s])
+            shapes.setdefault(shape, []).append(s)
+        self.stack_groups = list(shapes.values())
+        self.key_typecode = "B" if len(self.containers) < 256 and self.n_classes < 255 else "H"
+
+        # pattern database of heuristic_4, built on its first evaluation
+        self.pattern_database = None
+
+    def encode(self, ship_port, locations):
+        """Returns the state for the ship port and the list of container locations"""
+        return array(self.typecode, [ship_port] + list(locations)).tobytes()
+
+    def decode(self, state):
+        """Returns the state as an array [ship_port, location_0, location_1, ...]"""
+        decoded = array(self.typecode)
+        decoded.frombytes(state)
+        return decoded
+
+    def stack_heights(self, decoded):
+        """Returns the list with the number of containers in every stack for the decoded state"""
+        heights = [0] * len(self.stacks)
+        for location in decoded[1:]:
+            if location >= self.n_ports:
+                heights[self.cell_stack[location - self.n_ports][0]] += 1
+        return heights
+
+    def canonical_key(self, state):
+        """Returns a key shared by all the states that are equal up to swapping containers of the same class or stacks
+        of the same group: the ship port, the number of containers of each class in each port and, for each group of
+        stacks, the sorted contents of its stacks as the classes of their containers from the floor"""
+        decoded = self.decode(state)
+        counts = [0] * (self.n_ports * self.n_classes)
+        contents = [[0] * len(stack) for stack in self.stacks]
+        for i, location in enumerate(decoded[1:]):
+            if location < self.n_ports:
+                counts[location * self.n_classes + self.container_class[i]] += 1
+            else:
+                stack, level = self.cell_stack[location - self.n_ports]
+                contents[stack][level] = self.container_class[i] + 1
+
+        key = [decoded[0]] + counts
+        for group in self.stack_groups:
+            for content in sorted(contents[s] for s in group):
+                key.extend(content)
+        return array(self.key_typecode, key).tobytes()
+
+    def replace(self, state, index, value):
+        """Returns a copy of the state with the value at index (0 is the ship port, i + 1 the container i) replaced"""
+        start = index * self.itemsize
+        return state[:start] + self.location_bytes[value] + state[start + self.itemsize:]
 
 
 class Node:
     """ class of the node """
-    def __init__(self, elem):
-        self.elem = elem  # tuple representing state: ([(container),(container),...], ship_current_port, ship_map)
+    __slots__ = ("state", "g", "h", "hdata", "parent", "action")
+
+    def __init__(self, state):
+        self.state = state  # bytes encoding the state, see StowageProblem
         self.parent = None
         self.action = None
         self.h = 0
+        self.hdata = None  # data to update the heuristic incrementally on the successors
         self.g = 0
 
     def __eq__(self, other):
-        """Method to establish two node objects are equal when their elem attribute is equal"""
+        """Method to establish two node objects are equal when their state is equal"""
         if not isinstance(other, Node):
             return NotImplemented
         else:
-            return self.elem == other.elem
+            return self.state == other.state
 
-    def cprint(self):
+    def __hash__(self):
+        """Method to hash a node by its state, bytes cache their hash so it is computed once"""
+        return hash(self.state)
+
+    def cprint(self, problem):
         """Auxiliary method to print a node (!!cannot be the parent node)"""
-        print("Containers list: ", self.elem[0])
-        print("Ship current location: ", self.elem[1])
-        print("Ship map: ", self.elem[2])
-        print("h: " + str(self.h) + ", g: " + str(self.g)+", f: "+str(self.f)+", action: "+self.action)
+        decoded = problem.decode(self.state)
+        print("Containers locations: ", list(decoded[1:]))
+        print("Ship current location: ", decoded[0])
+        print("h: " + str(self.h) + ", g: " + str(self.g)+", f: "+str(self.f)+", action: "+format_action(self.action))
         print("\n")
 
     @property
@@ -38,479 +196,1609 @@ class Node:
         return self.h + self.g
 
 
-def generate_initial(list_initial_containers, ship_map):
-    """Function that generates the initial state from parsed containers output. A state has the following format
-    ([(container),(container),...], ship_current_port)"""
+def node_footprint(node):
+    """Returns the memory in bytes held by a node on its own: the node, its encoded state and its action"""
+    return sys.getsizeof(node) + sys.getsizeof(node.state) + sys.getsizeof(node.action)
+
+
+def generate_initial(problem):
+    """Function that generates the initial state of the problem, with all containers in their parsed location"""
     # ship initial port is 0
-    init_state = (list_initial_containers, 0, ship_map)
+    init_state = problem.encode(0, problem.initial_locations)
     return init_state
 
 
 def parse_map(file_path, map_file):
     """Function that parses the map file returning a list where each element represents a cell in the ship following
-    the next structure (x, y, electrified(bool), occupied(bool))"""
-    file_complete_path = file_path+"/"+map_file+".txt"
-    try:
-        with open(file_complete_path, "r", encoding="utf-8", newline="") as file:
-            data = file.readlines()
-    except FileNotFoundError as ex:
-        raise Exception("Wrong path or file path") from ex
-
-    ship_map = []
-    row = 0
-    for line in data:
-        col = 0
-        for c in line:
-            if c != " ":
-                if c == "N":
-                    ship_map.append((row, col, False, False))
-                elif c == "E":
-                    ship_map.append((row, col, True, False))
-                elif c == "X":
-                    ship_map.append((row, col, False, True))
-                col += 1
-        row += 1
-
-    return ship_map
+    the next structure (x, y, electrified(bool), blocked(bool))"""
+    bay = stowage_model.load_bay(file_path + "/" + map_file + ".txt")
+    return [(row, col, kind == stowage_model.ELECTRIFIED, kind == stowage_model.BLOCKED)
+            for row, col, kind in bay.cells]
 
 
 def parse_containers(file_path, containers_file):
-    """Function that parses the map file returning a list where each element represents a cell in the ship following
+    """Function that parses the containers file returning a list where each element represents a container following
     the next structure (id, x, y, refrigerated(bool), location, destination)"""
-    file_complete_path = file_path + "/" + containers_file + ".txt"
-    try:
-        with open(file_complete_path, "r", encoding="utf-8", newline="") as file:
-            data = file.readlines()
-    except FileNotFoundError as ex:
-        raise Exception("Wrong path or file path") from ex
-
-    list_containers = []
+    manifest = stowage_model.load_manifest(file_path + "/" + containers_file + ".txt")
     # as position in port is irrelevant, x and y are set to None
-    for line in data:
-        c = line.split()
-        if c[1] == "R":
-            list_containers.append((int(c[0]), None, None, True, 0, int(c[2])))
-        else:
-            list_containers.append((int(c[0]), None, None, False, 0, int(c[2])))
+    return [(container_id, None, None, refrigerated, 0, destination)
+            for container_id, refrigerated, destination in manifest.containers]
 
-    return list_containers
 
-
-def check_goal(node):
+def check_goal(problem, node):
     """ Check that an node is a goal """
+    decoded = problem.decode(node.state)
 
     # traverse the list of containers
-    for c in node.elem[0]:
+    for i, c in enumerate(problem.containers):
         # if one is misplaced then return false
-        if c[4] != c[5]:
+        if decoded[i + 1] != c[2]:
             return False
 
     # if all are in the right port then return true
     return True
 
 
-def generate_successors(node, type_h):
-    """Returns the list of successors of node by applying all operators in every possible combination"""
-    # apply sail operators
-    list_successors = [sail_port0_port1(node, type_h), sail_port1_port0(node, type_h), sail_port1_port2(node, type_h),
-                       sail_port2_port1(node, type_h)]
-
-    for cont in node.elem[0]:
-        # apply unload operator on all containers
-        list_successors.append(unload(node, cont, type_h))
-
-        # for cell in state's ship map
-        for cell in node.elem[2]:
-            # apply load operator on all combinations of containers × cells
-            list_successors.append(load(node, cont, cell, type_h))
-
-    return list_successors
-
-
-def sail_port0_port1(node, type_h):
-    """Operator Sail from port 0 to port 1"""
-    return _sail(node, 0, 1, type_h)
-
-
-def sail_port1_port0(node, type_h):
-    """Operator Sail from port 1 to port 0"""
-    return _sail(node, 1, 0, type_h)
-
-
-def sail_port1_port2(node, type_h):
-    """Operator Sail from port 1 to port 2"""
-    return _sail(node, 1, 2, type_h)
-
-
-def sail_port2_port1(node, type_h):
-    """Operator Sail from port 2 to port 1"""
-    return _sail(node, 2, 1, type_h)
-
-
-def _sail(node, origin_port, destination_port, type_h):
+def successor_moves(problem, node):
+    """Returns the decoded state of node and all its legal moves, found in one pass using the height of the stacks to
+    find the load cells and the containers on top. A move is (g, state, container, location): the cost and state of
+    the successor, the index of the moved container (None when the ship sails) and its new location (the new ship port
+    when the ship sails). No node is created, so the successors that turn out to be duplicates cost no more than this"""
+    state = node.state
+    g = node.g
+    decoded = problem.decode(state)
+    ship_port = decoded[0]
+    n_ports = problem.n_ports
+    replace = problem.replace
+
+    # sail to the ports reachable from the ship port
+    moves = [(g + SAIL_COST, replace(state, 0, port), None, port) for port in problem.sail_ports[ship_port]]
+
+    # height of every stack, and the only cell where each stack that is not full can be loaded, in the order of the
+    # ship map
+    heights = problem.stack_heights(decoded)
+    load_cells = sorted(problem.stacks[s][heights[s]] for s in range(len(problem.stacks))
+                        if heights[s] < len(problem.stacks[s]))
+    electrified_load_cells = [cell for cell in load_cells if problem.cells[cell][2]]
+
+    for cont in range(len(problem.containers)):
+        location = decoded[cont + 1]
+        refrigerated, destination = problem.containers[cont][1:]
+
+        if location >= n_ports:
+            # unload the container in the ship port if it is on top of its stack
+            cell = location - n_ports
+            if _on_top(problem, heights, cell):
+                moves.append((g + UNLOAD_COST * problem.cells[cell][0], replace(state, cont + 1, ship_port), cont,
+                              ship_port))
+
+        elif location == ship_port and location != destination:
+            # load the container waiting in the ship port, which is not its destination, on the load cells of all the
+            # stacks (electrified ones if it is refrigerated)
+            for cell in electrified_load_cells if refrigerated else load_cells:
+                moves.append((g + LOAD_COST * problem.cells[cell][0], replace(state, cont + 1, cell + n_ports), cont,
+                              cell + n_ports))
+
+    return decoded, moves
+
+
+def successor_node(problem, node, decoded, move, type_h, update=None):
+    """Returns the successor node of node for one of its moves, given its decoded state, with its heuristic value
+    computed by update, update_heuristic by default"""
+    new_node = Node(move[1])
+    new_node.g = move[0]
+    new_node.parent = node
+    new_node.action = move_action(problem, decoded, move)
+    (update or update_heuristic)(problem, new_node, node, decoded, move[2], type_h)
+    return new_node
+
+
+def move_action(problem, decoded, move):
+    """Returns the action of a move from the decoded state. Actions are kept as tuples, only turned into text when the
+    plan is written"""
+    container, location = move[2:]
+    if container is None:
+        return "sail", decoded[0], location
+    if location < problem.n_ports:
+        return "unload", problem.containers[container][0]
+    x, y = problem.cells[location - problem.n_ports][:2]
+    return "load", problem.containers[container][0], x, y
+
+
+def generate_successors(problem, node, type_h):
+    """Returns the list of the successor nodes of node, for all its legal moves"""
+    decoded, moves = successor_moves(problem, node)
+    return [successor_node(problem, node, decoded, move, type_h) for move in moves]
+
+
+def _sail(problem, node, origin_port, destination_port, type_h):
     """Private function that takes a node, an origin and a destination port and performs the sail operator.
     Return None if cannot apply on passed node. Otherwise, return child node"""
     # operator precondition: ship current location is the origin port passed
-    if isinstance(node, Node) and node.elem[1] == origin_port:
+    if isinstance(node, Node) and problem.decode(node.state)[0] == origin_port:
         # operator effect: ship current location changed to destination port
-        new_state = (node.elem[0], destination_port, node.elem[2])
-        new_node = Node(new_state)
-
-        # set h and g, parent and action of new node
-        calculate_heuristic(new_node, type_h)
-        new_node.g = node.g + SAIL_COST
-        new_node.parent = node
-        new_node.action = "sail(" + str(origin_port) + ", " + str(destination_port) + ")"
-        return new_node
+        return successor_node(problem, node, problem.decode(node.state),
+                              (node.g + SAIL_COST, problem.replace(node.state, 0, destination_port), None,
+                               destination_port), type_h)
     return None
 
 
-def load(node, container, cell, type_h):
-    """Function that applies the load operator. Returns child node or None if operator cannot be applied on parent"""
-    # operator preconditions: the ship is in the port where the container is, cell is not occupied,
-    # cell is electrified if container is refrigerated (implemented as not refrigerated or electrified),
-    # cell below is not empty, container is not already in its dest
-    if (node.elem[1] == container[4]) and (not cell[3]) and (not container[3] or cell[2]) \
-            and (not _cell_below_empty(cell, node.elem[2])) and container[4] != container[5]:
-        # operator effects: change location of the container (new node), update ship map
-        new_ship_map = _update_cell_avail(node.elem[2], cell[0], cell[1], True)
-        new_state = _change_container_location(node, container, cell[0], cell[1], "S", new_ship_map)
-
-        # set h and g, parent and action of new node
-        new_node = Node(new_state)
-        calculate_heuristic(new_node, type_h)
-        new_node.parent = node
-        new_node.g = node.g + LOAD_COST * cell[0]
-        new_node.action = "load(container"+str(container[0])+", cell("+str(cell[0])+", "+str(cell[1])+"))"
-        return new_node
-    return None
+def format_action(action):
+    """Returns the text of an action of a plan"""
+    if action[0] == "sail":
+        return "sail(%d, %d)" % action[1:]
+    if action[0] == "load":
+        return "load(container%d, cell(%d, %d))" % action[1:]
+    return "unload(container%d)" % action[1:]
 
 
-def unload(node, container, type_h):
-    """Function that implements unload operator. Returns child node or None if operator cannot be applied on parent"""
-    # operator preconditions:
-    # container is on the ship, cell above it is empty
-    if container[4] == "S" and _cell_above_empty(container, node.elem[2]):
-        # operator effects: change cell position on ship to not occupied
-        new_ship_map = _update_cell_avail(node.elem[2], container[1], container[2], False)
-        # when on port (x,y) positions are set to None because irrelevant
-        new_state = _change_container_location(node, container, None, None, node.elem[1], new_ship_map)
-
-        # set h and g, parent and action of new node
-        new_node = Node(new_state)
-        calculate_heuristic(new_node, type_h)
-        new_node.parent = node
-        new_node.g = node.g + UNLOAD_COST * container[1]
-        new_node.action = "unload(container" + str(container[0]) + ")"
-        return new_node
-    return None
+def _on_top(problem, heights, cell):
+    """Given the cell of a loaded container, returns True if cell above is empty and False otherwise"""
+    stack, level = problem.cell_stack[cell]
+    # the top cell of a stack right below an X cell is never empty above
+    return heights[stack] == level + 1 and not (problem.stack_capped[stack] and level == len(problem.stacks[stack]) - 1)
 
 
-def _change_container_location(node, container, new_x, new_y, new_location, new_ship_map):
-    """Returns the new state with the new positions and location for the indicated container"""
-    new_list_container = []
-    for c in node.elem[0]:
-        if c[0] == container[0]:
-            # new updated container
-            new_container = (container[0], new_x, new_y, container[3], new_location, container[5])
-            new_list_container.append(new_container)
-        else:
-            new_list_container.append(c)
+class Heuristic:
+    """ class of a heuristic in the registry. evaluate(problem, decoded) returns the value of a decoded state along
+    with the data needed to update it incrementally. update(problem, parent, decoded, container, location), if any,
+    returns the value and data of the successor of parent (whose decoded state is passed) where the container moved
+    to location without the ship sailing, or None when it has to be evaluated from scratch. admissible tells whether it
+    never overestimates the cost, so that it can bound the cost of the plans """
+    def __init__(self, name, evaluate, update=None, admissible=False):
+        self.name = name
+        self.evaluate = evaluate
+        self.update = update
+        self.admissible = admissible
 
-    new_state = (new_list_container, node.elem[1], new_ship_map)
-    return new_state
 
+HEURISTICS = {}
 
-def _cell_above_empty(container, ship_map):
-    """Given a loaded container, returns True if cell above is empty and False otherwise"""
-    for cell in ship_map:
-        if cell[0] == container[1] - 1 and cell[1] == container[2]:
-            return not cell[3]
-    # top layer, above always empty
-    return True
 
+def register_heuristic(name, evaluate, update=None, admissible=False):
+    """Adds a heuristic to the registry, so it can be selected by name from the command line"""
+    HEURISTICS[name] = Heuristic(name, evaluate, update, admissible)
 
-def _cell_below_empty(cell, ship_map):
-    """Given a cell, returns True if cell below is empty and False if it is occupied"""
-    for c in ship_map:
-        if c[0] == cell[0] + 1 and c[1] == cell[1]:
-            return not c[3]
-    # cell not found means it was already at lowest level, so there is no cell below (not empty)
-    return False
 
+def calculate_heuristic(problem, node, type_h):
+    """ Updates the heuristic attribute of node given an heuristic type, computing it from scratch """
+    node.h, node.hdata = heuristic_value(problem, node.state, type_h)
 
-def _update_cell_avail(ship_map, x, y, occupied):
-    """Given parent's ship map, generates a new map updating the cell in (x,y) position to change its availability"""
-    new_ship_map = []
-    for i in range(len(ship_map)):
-        if ship_map[i][0] == x and ship_map[i][1] == y:
-            # append updated cell to new map
-            new_ship_map.append((x, y, ship_map[i][2], occupied))
-        else:
-            new_ship_map.append(ship_map[i])
-    return new_ship_map
 
+def update_heuristic(problem, node, parent, decoded, container, type_h):
+    """ Updates the heuristic attribute of node incrementally from the one of its parent, given the decoded state of
+    the parent and the index of the container moved by the operator (None if the ship sailed) """
+    heuristic = HEURISTICS[type_h]
+    value = None
+    if container is not None and heuristic.update is not None:
+        value = heuristic.update(problem, parent, decoded, container, problem.decode(node.state)[container + 1])
 
-def calculate_heuristic(node, type_h):
-    """ Updates the heuristic attribute of node given an heuristic type """
-    # get the state of the node
-    state = node.elem
-    heu_value = 0
+    if value is None:
+        calculate_heuristic(problem, node, type_h)
+    else:
+        node.h, node.hdata = value
 
-    # get the current port of the ship
-    current_port = state[1]
-
-    # get the list of containers
-    containers_list = state[0]
-
-    if type_h == "heuristic_1":
-        for c in containers_list:
-            # if container is misplaced increment the heuristic
-            if c[4] != c[5]:
-                heu_value += 1
-
-    elif type_h == "heuristic_2":
-        # max number of travels the ship should do
-        max_ship_travels = 0
-
-        for c in containers_list:
-            # if container is misplaced
-            if c[4] != c[5]:
-                if c[4] in PORT_LIST:
-                    on_port = 1
-                else:
-                    on_port = 0
+    if HEURISTIC_CHECK and (node.h, node.hdata) != heuristic_value(problem, node.state, type_h):
+        raise Exception("Incremental " + type_h + " " + str((node.h, node.hdata)) + " differs from full computation "
+                        + str(heuristic_value(problem, node.state, type_h)))
 
-                # location & destination of container
-                location = c[4]
-                destination = c[5]
 
-                # if the location is the ship, then change the location to the current port
-                if c[4] == "S":
-                    location = current_port
+def heuristic_value(problem, state, type_h):
+    """ Returns the heuristic value of a state given an heuristic type, along with the data needed to update it
+    incrementally on its successors """
+    return HEURISTICS[type_h].evaluate(problem, problem.decode(state))
 
-                # compute the travels the ship should do for this container and update the max_ship_travels
-                container_ship_travels = abs(location - current_port) + abs(location - destination)
 
-                if max_ship_travels < container_ship_travels:
-                    max_ship_travels = container_ship_travels
+def _heuristic_1(problem, decoded):
+    """ Misplaced containers heuristic: the number of containers that are not in their destination """
+    heu_value = 0
+    for i, c in enumerate(problem.containers):
+        # if container is misplaced increment the heuristic
+        if decoded[i + 1] != c[2]:
+            heu_value += 1
+    return heu_value, None
 
-                # update heuristic value
-                heu_value = heu_value + on_port*LOAD_COST + UNLOAD_COST
 
-        heu_value = heu_value + max_ship_travels*SAIL_COST
+def _heuristic_1_update(problem, parent, decoded, container, location):
+    """ Only the moved container can become placed or misplaced """
+    destination = problem.containers[container][2]
+    return parent.h + (location != destination) - (decoded[container + 1] != destination), None
 
-    # update the heuristic of the node
-    node.h = heu_value
 
+def _heuristic_2(problem, decoded):
+    """ Furthest container heuristic: load/unload cost of the misplaced containers plus the sails needed by the one
+    that has to travel the furthest """
+    heu_value = 0
 
-def lower_f(node, list_nodes):
-    """ checks if node, that is also in list_nodes, has a lower value of f than the one in list """
-    # traverse the list and return true on the appearance of a node in the list equal to input node with greater f
-    for n in list_nodes:
-        if n == node and n.f > node.f:
-            return True
-    return False
+    # get the current port of the ship
+    current_port = decoded[0]
+
+    # max number of travels the ship should do and number of containers that need them
+    max_ship_travels = 0
+    max_count = 0
+
+    for i, c in enumerate(problem.containers):
+        # if container is misplaced
+        if decoded[i + 1] != c[2]:
+            cost, container_ship_travels = _heuristic_2_terms(problem, decoded[i + 1], c[2], current_port)
+
+            # update the max_ship_travels
+            if max_ship_travels < container_ship_travels:
+                max_ship_travels, max_count = container_ship_travels, 1
+            elif max_ship_travels == container_ship_travels:
+                max_count += 1
+
+            # update heuristic value
+            heu_value = heu_value + cost
+
+    return heu_value + max_ship_travels*SAIL_COST, (heu_value, max_ship_travels, max_count)
+
+
+def _heuristic_2_update(problem, parent, decoded, container, location):
+    """ Swaps the terms of the moved container, the max travels are kept with the number of containers needing them """
+    destination = problem.containers[container][2]
+    handling, max_ship_travels, max_count = parent.hdata
+
+    # take out the terms of the container in the parent
+    if decoded[container + 1] != destination:
+        cost, travels = _heuristic_2_terms(problem, decoded[container + 1], destination, decoded[0])
+        handling -= cost
+        if travels == max_ship_travels:
+            max_count -= 1
+
+    # add the terms of the container in the node, the ship port has not changed
+    if location != destination:
+        cost, travels = _heuristic_2_terms(problem, location, destination, decoded[0])
+        handling += cost
+        if max_ship_travels < travels:
+            max_ship_travels, max_count = travels, 1
+        elif max_ship_travels == travels:
+            max_count += 1
+
+    if max_count == 0:
+        # the container was the only one with the max travels, the max has to be found again
+        return None
+    return handling + max_ship_travels*SAIL_COST, (handling, max_ship_travels, max_count)
+
+
+def _heuristic_2_terms(problem, location, destination, current_port):
+    """ Returns the load/unload cost and the travels the ship should do for a misplaced container in heuristic_2 """
+    # a container in a port has to be loaded, one on the ship travels from the current port
+    if location < problem.n_ports:
+        on_port = 1
+    else:
+        on_port = 0
+        location = current_port
+
+    # compute the travels the ship should do for this container
+    distance = problem.port_distance
+    container_ship_travels = distance[current_port][location] + distance[location][destination]
+
+    return on_port*LOAD_COST + UNLOAD_COST, container_ship_travels
+
+
+def _heuristic_3(problem, decoded):
+    """ Stowage heuristic, admissible for the height dependent costs. Every misplaced container on the ship is next
+    unloaded from its row, and one in a port has to be loaded and unloaded at least at the lowest row it fits in. The
+    ship has to visit the port of every container in a port and the destination of every misplaced container, which
+    takes at least the sails of the furthest container and of visiting any two of those ports, the closest one first.
+    A container stacked on another one with a different destination either is relocated, or the relocation of the one
+    below is needed, or the ship visits its destination before the one of the container below """
+    current_port = decoded[0]
+    distance = problem.port_distance
+    handling = 0
+    ship_travels = 0
+    # ports the ship has to visit
+    visits = {current_port}
+    # (level, relocation cost, destination) of the containers in every stack
+    stacks = {}
+
+    for i, c in enumerate(problem.containers):
+        location = decoded[i + 1]
+        destination = c[2]
+        if location == destination:
+            continue
+
+        # lowest row where the container can be loaded, any relocation costs at least a load and an unload there
+        min_row = problem.min_load_row[c[1]]
+        if min_row is None:
+            # the container can never be loaded
+            return float("inf"), None
+        relocation = (LOAD_COST + UNLOAD_COST) * min_row
+
+        if location >= problem.n_ports:
+            x = problem.cells[location - problem.n_ports][0]
+            stack, level = problem.cell_stack[location - problem.n_ports]
+            stacks.setdefault(stack, []).append((level, relocation, destination))
+
+            handling += UNLOAD_COST * x
+            travels = distance[current_port][destination]
+        else:
+            handling += relocation
+            travels = distance[current_port][location] + distance[location][destination]
+            visits.add(location)
+
+        ship_travels = max(ship_travels, travels)
+        visits.add(destination)
+
+    # visiting two of the ports starts by the closest one
+    visits = sorted(visits)
+    for i, p in enumerate(visits):
+        for q in visits[i + 1:]:
+            ship_travels = max(ship_travels, min(distance[current_port][p], distance[current_port][q]) + distance[p][q])
+    sailing = ship_travels * SAIL_COST
+
+    # blocking containers
+    blocking = sailing
+    for stack in stacks.values():
+        stack.sort()
+        for below in range(len(stack)):
+            for above in range(below + 1, len(stack)):
+                if stack[below][2] != stack[above][2]:
+                    # visiting the destination of the one above before the destination of the one below
+                    route = (distance[current_port][stack[above][2]] + distance[stack[above][2]][stack[below][2]]) \
+                        * SAIL_COST
+                    relocation = min(stack[below][1], stack[above][1])
+                    blocking = max(blocking, min(route, sailing + relocation))
+
+    return handling + blocking, None
+
+
+class PatternDatabase:
+    """ Pattern database of the pairs of containers. The abstract problem of a pair keeps the ship and those two
+    containers only, and lets them be loaded in any free cell with the other one not above it, so that every plan of
+    the full problem is a plan of the abstract one at no higher cost. The table of a pair of container classes
+    (refrigeration and destination) holds the exact cost to the goal of every abstract state [ship_port, location_a,
+    location_b], found with a backward Dijkstra search from the goal states. The tables only depend on the bay shape and
+    the route, and with a directory they are saved there as arrays of 32 bit costs and memory mapped by later runs """
+
+    def __init__(self, problem, directory=None):
+        self.problem = problem
+        self.directory = directory
+        self.size = problem.n_ports + len(problem.cells)
+        # cells where the refrigerated (True) and standard (False) containers can be loaded
+        self.legal_cells = {True: [c for c, cell in enumerate(problem.cells) if cell[2]],
+                            False: list(range(len(problem.cells)))}
+        # the top cell of a capped stack can never be unloaded
+        self.capped = [problem.stack_capped[stack] and level == len(problem.stacks[stack]) - 1
+                       for stack, level in problem.cell_stack]
+        shape = json.dumps([problem.cells, problem.stacks, problem.stack_capped, problem.sail_ports, LOAD_COST,
+                            UNLOAD_COST, SAIL_COST, PATTERN_VERSION])
+        self.shape_key = hashlib.sha256(shape.encode("utf-8")).hexdigest()[:16]
+
+        # table of every pair of containers i < j and whether their classes are swapped in it
+        tables = {}
+        self.pair_tables = {}
+        for i, j in itertools.combinations(range(len(problem.containers)), 2):
+            class_i, class_j = problem.containers[i][1:], problem.containers[j][1:]
+            swapped = class_i > class_j
+            pair = (class_j, class_i) if swapped else (class_i, class_j)
+            if pair not in tables:
+                tables[pair] = self._table(*pair)
+            self.pair_tables[i, j] = (tables[pair], swapped)
+        # a container on its own is paired with one of its class waiting in its destination
+        self.single_tables = []
+        for c in problem.containers:
+            pair = (c[1:], c[1:])
+            if pair not in tables:
+                tables[pair] = self._table(*pair)
+            self.single_tables.append(tables[pair])
+
+    def _table(self, class_a, class_b):
+        """ Returns the table of the pair of classes, from the tables kept by the process or its file when there is
+        one """
+        if PATTERN_TABLES is not None:
+            key = (self.shape_key, class_a, class_b)
+            if key not in PATTERN_TABLES:
+                PATTERN_TABLES[key] = self._load(class_a, class_b)
+            return PATTERN_TABLES[key]
+        return self._load(class_a, class_b)
+
+    def _load(self, class_a, class_b):
+        """ Returns the table of the pair of classes, from its file when there is one """
+        if self.directory is None:
+            return self._compute(class_a, class_b)
+
+        path = self.directory + "/pattern-" + self.shape_key + "-%d%d-%d%d.pdb" % (class_a + class_b)
+        if not os.path.exists(path) or os.path.getsize(path) != 4 * self.problem.n_ports * self.size * self.size:
+            # written aside and renamed, so that concurrent runs never map a partial file
+            temporary = path + ".%d" % os.getpid()
+            with open(temporary, "wb") as file:
+                self._compute(class_a, class_b).tofile(file)
+            os.replace(temporary, path)
+        with open(path, "rb") as file:
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)).cast("I")
+
+    def _compute(self, class_a, class_b):
+        """ Returns the table of the pair of classes computed with a backward Dijkstra search from the goal states """
+        n_ports, size = self.problem.n_ports, self.size
+        cost = array("I", [PATTERN_UNREACHABLE]) * (n_ports * size * size)
+        open_states = []
+        for port in range(n_ports):
+            cost[(port * size + class_a[1]) * size + class_b[1]] = 0
+            open_states.append((0, port, class_a[1], class_b[1]))
+
+        while open_states:
+            g, port, a, b = heapq.heappop(open_states)
+            if g > cost[(port * size + a) * size + b]:
+                continue
+            predecessors = [(SAIL_COST, p, a, b) for p in self.problem.sail_ports[port]]
+            predecessors.extend((c, port, location, b) for c, location in self._moves(port, a, b, class_a))
+            predecessors.extend((c, port, a, location) for c, location in self._moves(port, b, a, class_b))
+            for c, p, pa, pb in predecessors:
+                index = (p * size + pa) * size + pb
+                if g + c < cost[index]:
+                    cost[index] = g + c
+                    heapq.heappush(open_states, (g + c, p, pa, pb))
+        return cost
+
+    def _moves(self, port, mover, other, container_class):
+        """ Returns the (cost, location) of the mover before every abstract load or unload that leads to its location,
+        with the ship in port and the other container in its location """
+        problem = self.problem
+        n_ports = problem.n_ports
+        moves = []
+        if mover >= n_ports:
+            # loaded from the ship port, which is not its destination
+            cell = mover - n_ports
+            if port != container_class[1] and not self._below(other, cell):
+                moves.append((LOAD_COST * problem.cells[cell][0], port))
+        elif mover == port:
+            # unloaded from a cell it can be in, with nothing above
+            for cell in self.legal_cells[container_class[0]]:
+                if cell + n_ports != other and not self.capped[cell] and not self._below(other, cell):
+                    moves.append((UNLOAD_COST * problem.cells[cell][0], cell + n_ports))
+        return moves
+
+    def _below(self, other, cell):
+        """ Returns True if the cell is below the location of the other container, in the same stack """
+        if other < self.problem.n_ports:
+            return False
+        stack, level = self.problem.cell_stack[other - self.problem.n_ports]
+        return self.problem.cell_stack[cell][0] == stack and self.problem.cell_stack[cell][1] < level
+
+
+def _heuristic_4(problem, decoded):
+    """ Pattern database heuristic, admissible. Every misplaced container has a lower bound of its own handling cost as
+    in heuristic_3, and the actions of different containers are disjoint, so the exact cost of the abstract problem of
+    a pair of containers can be added to the bounds of all the other ones. The value is the best of those sums over the
+    pairs of misplaced containers """
+    if problem.pattern_database is None:
+        problem.pattern_database = PatternDatabase(problem, PATTERN_DIRECTORY)
+    database = problem.pattern_database
+    port = decoded[0]
+    size = database.size
+
+    # (container, location, handling bound) of the misplaced containers
+    misplaced = []
+    handling = 0
+    for i, c in enumerate(problem.containers):
+        location = decoded[i + 1]
+        if location == c[2]:
+            continue
+        if location >= problem.n_ports:
+            bound = UNLOAD_COST * problem.cells[location - problem.n_ports][0]
+        elif problem.min_load_row[c[1]] is None:
+            # the container can never be loaded
+            return float("inf"), None
+        else:
+            bound = (LOAD_COST + UNLOAD_COST) * problem.min_load_row[c[1]]
+        misplaced.append((i, location, bound))
+        handling += bound
+
+    best = 0
+    if len(misplaced) == 1:
+        i, location, bound = misplaced[0]
+        best = database.single_tables[i][(port * size + location) * size + problem.containers[i][2]]
+        best = float("inf") if best == PATTERN_UNREACHABLE else best - bound
+    for m, (i, location_i, bound_i) in enumerate(misplaced):
+        for j, location_j, bound_j in misplaced[m + 1:]:
+            table, swapped = database.pair_tables[i, j]
+            if swapped:
+                value = table[(port * size + location_j) * size + location_i]
+            else:
+                value = table[(port * size + location_i) * size + location_j]
+            if value == PATTERN_UNREACHABLE:
+                return float("inf"), None
+            best = max(best, value - bound_i - bound_j)
 
+    return handling + best, None
 
-def sorted_append(node, list_nodes):
-    """ Adds the node in the list in the proper place (h, g, f) """
-    # if the list is empty append the node
-    if len(list_nodes) == 0:
-        list_nodes.append(node)
 
-    # if the list has one element look for the right place
-    elif len(list_nodes) == 1:
-        # if the f value is greater append at the end
-        if list_nodes[0].f < node.f:
-            list_nodes.append(node)
+register_heuristic("heuristic_1", _heuristic_1, _heuristic_1_update)
+register_heuristic("heuristic_2", _heuristic_2, _heuristic_2_update)
+register_heuristic("heuristic_3", _heuristic_3, admissible=True)
+register_heuristic("heuristic_4", _heuristic_4, admissible=True)
 
-        # if the f value is lower insert at the beginning
-        elif list_nodes[0].f > node.f:
-            list_nodes.insert(0, node)
 
-        # if the f values are the same check the heuristic
-        else:
-            # if the heuristic is greater append at the end
-            if list_nodes[0].h < node.h:
-                list_nodes.append(node)
+def push_open(node, key, open_nodes, open_index, counter):
+    """ Pushes the node in the open heap, ordered by f and then by h. The insertion counter keeps nodes with equal f
+    and h in the order they were generated. The node becomes the live entry of its state key in open_index """
+    heapq.heappush(open_nodes, (node.f, node.h, next(counter), key, node))
+    open_index[key] = node
 
-            # if the heuristic is lower insert at the beginning
-            else:
-                list_nodes.insert(0, node)
 
-    # if the list has more elements
-    else:
-        # traverse the list
-        i = 0
-        control = False
-        while i < len(list_nodes) and not control:
+def pop_open(open_nodes, open_index):
+    """ Pops the live node with the lowest (f, h) from the open heap, skipping the stale entries left behind when a
+    state was reached again with a lower f. Returns the state key and the node, or None when the open list is
+    exhausted """
+    while open_nodes:
+        entry = heapq.heappop(open_nodes)
+        # a stale entry is no longer the live node of its state
+        if open_index.get(entry[3]) is entry[4]:
+            del open_index[entry[3]]
+            return entry[3:]
+    return None
 
-            # if the f value is lower
-            if node.f < list_nodes[i].f:
 
-                # if the index is the last one insert at the end
-                if i == len(list_nodes) - 1:
-                    list_nodes.insert(len(list_nodes), node)
-                    control = True
+def _same_state(state):
+    """Returns the state as its own key in the open and closed lists"""
+    return state
 
-                # else insert in the correct place
-                else:
-                    list_nodes.insert(i, node)
-                    control = True
 
-            # if the f values are the same check heuristic
-            elif node.f == list_nodes[i].f:
+def a_star_search(problem, init_state, type_h, symmetry=True, monitor=None, bound=float("inf")):
+    """ A* implementation. With symmetry, states are looked up in the open and closed lists by their canonical key, so
+    the states that only differ by swapping interchangeable containers or stacks are explored once. A SearchMonitor
+    instruments the search, which otherwise runs the plain functions. The successors whose f exceeds bound, the cost of
+    a known plan with an admissible heuristic, are never pushed """
+    state_key = problem.canonical_key if symmetry else _same_state
+    if monitor is None:
+        return _a_star_search(problem, init_state, type_h, state_key, check_goal, successor_moves, successor_node,
+                              push_open, pop_open, bound)
+    with monitor:
+        solution = _a_star_search(problem, init_state, type_h, *monitor.hooks(state_key), bound=bound)
+    if solution:
+        solution[1].update(monitor.summary())
+    return solution
 
-                # if the heuristic is lower insert node in the list
-                if node.h < list_nodes[i].h:
-                    if i == len(list_nodes) - 1:
-                        list_nodes.insert(len(list_nodes), node)
-                        control = True
 
-                    else:
-                        list_nodes.insert(i, node)
-                        control = True
+def _a_star_search(problem, init_state, type_h, state_key, goal, expand, make, push, pop, bound=float("inf")):
+    """ A* loop, calling state_key, goal, expand, make, push and pop to find the key of a state in the open and closed
+    lists, check the goal, generate the moves of a node, create the successor node of a move and push and pop the open
+    heap. The successors whose f exceeds bound are dropped """
+    # create the initial node and update its heuristic value
+    init_node = Node(init_state)
+    calculate_heuristic(problem, init_node, type_h)
+
+    # create the open heap with its index of live nodes by state key, and the closed set of state keys
+    open_nodes = []
+    open_index = {}
+    counter = itertools.count()
+    push(init_node, state_key(init_state), open_nodes, open_index, counter)
+    closed_nodes = set()
+    # expanded nodes counter and max number of entries in the open and closed lists
+    expanded_nodes = 0
+    peak_nodes = 1
 
-            # if the f is always greater and the place to insert it has not been found append it at the end
-            if i == len(list_nodes) - 1 and control is False:
-                list_nodes.append(node)
-                control = True
+    # loop until the open list is exhausted
+    entry = pop(open_nodes, open_index)
+    while entry is not None:
+        current_key, current_node = entry
 
-            # if the f is greater it will continue traversing the list
-            i += 1
+        # if the goal is reached then generate the path
+        if goal(problem, current_node):
+            return generate_path(current_node), {"expanded_nodes": expanded_nodes, "peak_nodes": peak_nodes}
+
+        # generate the moves to the successors of current node
+        decoded, moves = expand(problem, current_node)
+
+        # update expanded_nodes
+        expanded_nodes += 1
+
+        # add current node to closed set
+        closed_nodes.add(current_key)
+
+        for move in moves:
+            key = state_key(move[1])
+            # if its state has not been expanded yet
+            if key not in closed_nodes:
+                in_open = open_index.get(key)
+
+                # the states of a key share their heuristic value, so a lower g is a lower f. Only the successors that
+                # are pushed become nodes: the successor is pushed if it is not in open or if it has lower cost than
+                # the one in open, the replaced entry is left in the heap as stale (lazy decrease-key)
+                if in_open is None or in_open.g > move[0]:
+                    n = make(problem, current_node, decoded, move, type_h)
+                    if n.f <= bound:
+                        push(n, key, open_nodes, open_index, counter)
+
+        peak_nodes = max(peak_nodes, len(open_nodes) + len(closed_nodes))
+        entry = pop(open_nodes, open_index)
+    return False
 
-    return list_nodes
 
+class SearchMonitor:
+    """ Instrumentation of an A* search: counters of generated, duplicate (pruned as closed or worse than the one in
+    open), bound pruned (f over the bound of the search), reopened (better than the one in open) and expanded nodes, the time spent in every phase, samples of the
+    open and closed sizes, and the peak memory. Samples can be written as a JSON lines trace and a progress line printed
+    periodically. Only the searches given a monitor pay for it: the search calls timed versions of its functions, and
+    the successors are created with a timed incremental heuristic """
+    PHASES = ("successors", "heuristic", "state_key", "open_list", "goal_check")
+
+    def __init__(self, trace=None, sample_every=1000, progress=None, progress_every=1.0):
+        self.generated = 0
+        # successors that passed the closed and open checks, and the pushed ones among them
+        self.made = 0
+        self.pushed = 0
+        self.reopened = 0
+        self.expanded = 0
+        self.phase_time = dict.fromkeys(self.PHASES, 0.0)
+        # (seconds, expanded, generated, open, closed, f) every sample_every expanded nodes
+        self.samples = []
+        self.sample_every = sample_every
+        self.trace = trace
+        self.progress = progress
+        self.progress_every = progress_every
+        self._start = self._next_progress = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._next_progress = self._start + self.progress_every
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.write(json.dumps(dict(event="end", **self.summary())) + "\n")
+            self.trace.flush()
+        return False
+
+    def _timed_heuristic(self, update):
+        """ Returns the incremental heuristic update adding its time to the heuristic phase """
+        clock = time.perf_counter
+        phase_time = self.phase_time
+
+        def timed_update(problem, node, parent, decoded, container, type_h):
+            start = clock()
+            update(problem, node, parent, decoded, container, type_h)
+            phase_time["heuristic"] += clock() - start
+        return timed_update
+
+    def hooks(self, state_key):
+        """ Returns the timed and counted versions of state_key, check_goal, successor_moves, successor_node, push_open
+        and pop_open. The successors phase is the time of both successor functions, and successor_node is given the
+        timed incremental heuristic """
+        clock = time.perf_counter
+        phase_time = self.phase_time
+        update = self._timed_heuristic(update_heuristic)
+
+        def key(state):
+            start = clock()
+            k = state_key(state)
+            phase_time["state_key"] += clock() - start
+            return k
+
+        def goal(problem, node):
+            start = clock()
+            reached = check_goal(problem, node)
+            phase_time["goal_check"] += clock() - start
+            return reached
+
+        def expand(problem, node):
+            start = clock()
+            decoded, moves = successor_moves(problem, node)
+            phase_time["successors"] += clock() - start
+            self.generated += len(moves)
+            self.expanded += 1
+            return decoded, moves
+
+        def make(problem, node, decoded, move, type_h):
+            start = clock()
+            new_node = successor_node(problem, node, decoded, move, type_h, update)
+            phase_time["successors"] += clock() - start
+            self.made += 1
+            return new_node
+
+        def push(node, key, open_nodes, open_index, counter):
+            start = clock()
+            if key in open_index:
+                self.reopened += 1
+            push_open(node, key, open_nodes, open_index, counter)
+            self.pushed += 1
+            phase_time["open_list"] += clock() - start
+
+        def pop(open_nodes, open_index):
+            start = clock()
+            entry = pop_open(open_nodes, open_index)
+            now = clock()
+            phase_time["open_list"] += now - start
+            if entry is not None:
+                if self.expanded % self.sample_every == 0:
+                    self._sample(now, len(open_index), entry[1].f)
+                if self.progress is not None and now >= self._next_progress:
+                    self._next_progress = now + self.progress_every
+                    self.progress.write("[%.1f s] expanded %d, generated %d, open %d, closed %d, f %s\n"
+                                        % (now - self._start, self.expanded, self.generated, len(open_index),
+                                           self.expanded, entry[1].f))
+                    self.progress.flush()
+            return entry
+
+        return key, goal, expand, make, push, pop
+
+    def _sample(self, now, open_size, f):
+        """ Records the sizes of the open and closed lists, and writes them to the trace """
+        sample = (now - self._start, self.expanded, self.generated, open_size, self.expanded, f)
+        self.samples.append(sample)
+        if self.trace is not None:
+            self.trace.write(json.dumps(dict(zip(("time", "expanded", "generated", "open", "closed", "f"),
+                                                 sample))) + "\n")
+
+    def summary(self):
+        """ Returns the counters, the time of every phase in milliseconds, the successor generation one without the
+        heuristic, and the peak memory in MB """
+        summary = {"generated_nodes": self.generated,
+                   "duplicate_nodes": self.generated - self.made,
+                   # the initial node is pushed without being made
+                   "pruned_nodes": self.made - self.pushed + 1,
+                   "reopened_nodes": self.reopened}
+        for phase in self.PHASES:
+            summary["time_" + phase] = self.phase_time[phase] * 1000
+        summary["time_successors"] -= summary["time_heuristic"]
+        if resource is not None:
+            summary["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return summary
+
+
+def ida_star_search(problem, init_state, type_h, symmetry=True, node_budget=0):
+    """ IDA* implementation: depth-first searches that only go through nodes with f below a threshold, raised on every
+    iteration to the lowest f that exceeded it. Only the current path is kept in memory, plus a transposition table of
+    at most node_budget state keys with the lowest g they were reached with in the iteration, to prune the paths that
+    reach a state again at no lower cost. With an admissible heuristic, the first plan found is optimal """
+    state_key = problem.canonical_key if symmetry else _same_state
 
-def a_star_search(init_state, type_h):
-    """ A* implementation """
     # create the initial node and update its heuristic value
     init_node = Node(init_state)
-    calculate_heuristic(init_node, type_h)
+    calculate_heuristic(problem, init_node, type_h)
+    init_key = state_key(init_state)
 
-    # create the open and closed node lists
-    open_nodes = [init_node]
-    closed_nodes = []
-    # expanded nodes counter
     expanded_nodes = 0
+    peak_nodes = 1
+    threshold = init_node.f
+
+    while threshold != float("inf"):
+        next_threshold = float("inf")
+        table = {}
+        # stack of [node, state key, iterator over the successors not visited yet], and state keys in the path
+        stack = [[init_node, init_key, None]]
+        on_path = {init_key}
+
+        while stack:
+            frame = stack[-1]
+            if frame[2] is None:
+                # first visit of the node: goal check and expansion, trying the best successors first
+                if check_goal(problem, frame[0]):
+                    return generate_path(frame[0]), {"expanded_nodes": expanded_nodes, "peak_nodes": peak_nodes}
+                expanded_nodes += 1
+                successors = generate_successors(problem, frame[0], type_h)
+                successors.sort(key=lambda n: (n.f, n.h))
+                frame[2] = iter(successors)
+
+            child = next(frame[2], None)
+            if child is None:
+                # backtrack
+                stack.pop()
+                on_path.discard(frame[1])
+                continue
+
+            if child.f > threshold:
+                next_threshold = min(next_threshold, child.f)
+                continue
+
+            # skip cycles and states already reached in the iteration with a lower or equal g
+            key = state_key(child.state)
+            if key in on_path or table.get(key, child.g + 1) <= child.g:
+                continue
+            if key in table or len(table) < node_budget:
+                table[key] = child.g
+
+            stack.append([child, key, None])
+            on_path.add(key)
+            peak_nodes = max(peak_nodes, len(stack) + len(table))
+
+        threshold = next_threshold
+    return False
 
-    # loop until the open list is zero
-    while len(open_nodes) != 0:
-        # take the first node in the list and remove it from the list
-        current_node = open_nodes[0]
-        open_nodes.pop(0)
 
-        # if the goal is reached then generate the path
-        if check_goal(current_node):
-            path = []
+def anytime_search(problem, init_state, type_h, symmetry=True, weight=5.0, weight_step=1.0, time_limit=None,
+                   max_expansions=None, on_solution=None):
+    """ Anytime weighted A* implementation: nodes are expanded by g + weight*h, so a first plan is found quickly, and
+    the search goes on after each plan with the weight lowered by weight_step (down to 1), pruning the nodes whose
+    f = g + h cannot improve the best plan and reopening the states reached with a lower g. The lowest f in the open
+    list is a lower bound of the optimal cost, which gives the sub-optimality bound of the best plan. The search ends
+    when the open list is exhausted (the best plan is optimal with an admissible heuristic), or when time_limit seconds
+    or max_expansions expansions are reached. on_solution(path, stats) is called on every improved plan """
+    state_key = problem.canonical_key if symmetry else _same_state
+    start_t = time.time()
+
+    # create the initial node and update its heuristic value
+    init_node = Node(init_state)
+    calculate_heuristic(problem, init_node, type_h)
+
+    # open heap ordered by weighted f, its index of live nodes and the closed states with the g they were expanded with
+    open_nodes = []
+    open_index = {}
+    counter = itertools.count()
+    _push_weighted(init_node, state_key(init_state), weight, open_nodes, open_index, counter)
+    closed_nodes = {}
+
+    stats = {"expanded_nodes": 0, "peak_nodes": 1, "solutions": []}
+    best = None
+
+    entry = pop_open(open_nodes, open_index)
+    while entry is not None:
+        current_key, current_node = entry
+        if best is not None and current_node.f >= best.g:
+            # cannot improve the best plan
+            entry = pop_open(open_nodes, open_index)
+            continue
+
+        if check_goal(problem, current_node):
+            best = current_node
+            # lower the weight and sort the open list again
+            weight = max(1.0, weight - weight_step)
+            open_nodes = []
+            for key, node in open_index.items():
+                open_nodes.append((node.g + weight*node.h, node.h, next(counter), key, node))
+            heapq.heapify(open_nodes)
+
+            stats["solutions"].append((best.g, _suboptimality_bound(best, open_index), (time.time() - start_t)*1000,
+                                       stats["expanded_nodes"]))
+            if on_solution is not None:
+                on_solution(generate_path(best), stats)
 
-            # path is generated in the following way; the first node is the goal and the final one is the initial state
-            while current_node != init_node:
-                path.append(current_node)
-                current_node = current_node.parent
-            path.append(init_node)
+        else:
+            if (time_limit is not None and time.time() - start_t >= time_limit) or \
+                    (max_expansions is not None and stats["expanded_nodes"] >= max_expansions):
+                # put the node back to compute the bound and stop
+                open_index[current_key] = current_node
+                break
+
+            stats["expanded_nodes"] += 1
+            closed_nodes[current_key] = current_node.g
+
+            for n in generate_successors(problem, current_node, type_h):
+                if best is not None and n.f >= best.g:
+                    continue
+                key = state_key(n.state)
+                # states are reopened when reached with a lower g
+                if closed_nodes.get(key, n.g + 1) <= n.g:
+                    continue
+                in_open = open_index.get(key)
+                if in_open is None or in_open.g > n.g:
+                    closed_nodes.pop(key, None)
+                    _push_weighted(n, key, weight, open_nodes, open_index, counter)
+
+            stats["peak_nodes"] = max(stats["peak_nodes"], len(open_nodes) + len(closed_nodes))
+
+        entry = pop_open(open_nodes, open_index)
+
+    if best is None:
+        return False
+    stats["bound"] = _suboptimality_bound(best, open_index)
+    return generate_path(best), stats
+
+
+def _push_weighted(node, key, weight, open_nodes, open_index, counter):
+    """ Pushes the node in the open heap ordered by g + weight*h and then by h """
+    heapq.heappush(open_nodes, (node.g + weight*node.h, node.h, next(counter), key, node))
+    open_index[key] = node
+
+
+def _suboptimality_bound(best, open_index):
+    """ Returns the ratio between the cost of the best plan and the lowest f of the nodes that may still improve it,
+    a lower bound of the optimal cost with an admissible heuristic """
+    lower_bound = min([node.f for node in open_index.values() if node.f < best.g], default=best.g)
+    return best.g / lower_bound if lower_bound > 0 else 1.0
+
+
+def leg_search(problem, start_node, goal, estimate):
+    """ A* on the moves of a single port, without sailing: from start_node until goal(decoded) holds, with
+    estimate(decoded) as heuristic. Returns the goal node, chained to start_node, and the expanded and peak nodes, or
+    None if the goal cannot be reached in the port """
+    port = start_node.state[0]
+    start_node.h = estimate(problem.decode(start_node.state))
+
+    open_nodes = []
+    open_index = {}
+    counter = itertools.count()
+    push_open(start_node, start_node.state, open_nodes, open_index, counter)
+    closed_nodes = set()
+    expanded_nodes = 0
+    peak_nodes = 1
+
+    entry = pop_open(open_nodes, open_index)
+    while entry is not None:
+        current_key, current_node = entry
+        decoded = problem.decode(current_node.state)
+        if goal(decoded):
+            return current_node, expanded_nodes, peak_nodes
+
+        expanded_nodes += 1
+        closed_nodes.add(current_key)
+        # the heuristic of the successors is replaced by the estimate, heuristic_1 is the cheapest to compute
+        for n in generate_successors(problem, current_node, "heuristic_1"):
+            if n.state[0] != port or n.state in closed_nodes:
+                continue
+            n.h = estimate(problem.decode(n.state))
+            in_open = open_index.get(n.state)
+            if in_open is None or in_open.f > n.f:
+                push_open(n, n.state, open_nodes, open_index, counter)
+
+        peak_nodes = max(peak_nodes, len(open_nodes) + len(closed_nodes))
+        entry = pop_open(open_nodes, open_index)
+    return None
 
-            tup = (path, expanded_nodes)
-            return tup
 
-        # if the current state is not a goal
+def stowage_plan(problem):
+    """ Returns the cell index of every container in the cheapest stowage of all the containers that can be unloaded
+    port after port without moving any other container, None if there is none. The stowage is a solution of the part 1
+    problem, whose model is imported here so that the other engines do not need its python-constraint dependency """
+    import CSPStowage
+
+    segments = [[problem.cells[cell][:2] for cell in stack] for stack in problem.stacks]
+    electrified = [cell[:2] for cell in problem.cells if cell[2]]
+    containers = list(range(len(problem.containers)))
+    refrigerated = [i for i in containers if problem.containers[i][1]]
+    destinations = [c[2] for c in problem.containers]
+
+    # every container is loaded and unloaded once, at the row of its cell
+    stowage = CSPStowage.cheapest_stowage(segments, electrified, containers, destinations, refrigerated,
+                                          lambda cell: (LOAD_COST + UNLOAD_COST) * cell[0])
+    if stowage is None:
+        return None
+    cell_index = {cell[:2]: i for i, cell in enumerate(problem.cells)}
+    return [cell_index[stowage[i]] for i in containers]
+
+
+def decomposed_search(problem, init_state, type_h, symmetry=True):
+    """ Plans the voyage leg by leg: a cheapest stowage consistent with the unload order is taken from the part 1
+    model, loaded at port 0 with a first leg search, and each following port only unloads its containers with its own
+    leg search. The legs are small searches with exact heuristics, but the plan can cost more than the optimal one,
+    which may move containers between stacks at the ports. When there is no consistent stowage or a leg fails, the
+    whole voyage is searched with A* """
+    solution = decomposed_plan(problem, init_state, type_h)
+    if solution is None:
+        solution = a_star_search(problem, init_state, type_h, symmetry)
+        if solution:
+            solution[1]["decomposed"] = False
+    return solution
+
+
+def decomposed_plan(problem, init_state, type_h):
+    """ Returns the plan of the decomposed search, None when there is no consistent stowage or a leg fails """
+    targets = stowage_plan(problem) if all(c == 0 for c in problem.initial_locations) and init_state[0] == 0 \
+        else None
+    node = None
+    expanded_nodes = 0
+    peak_nodes = 0
+    if targets is not None:
+        node = Node(init_state)
+        calculate_heuristic(problem, node, type_h)
+        init_h = node.h
+        # the ship calls at the destination ports in the unload order of the stowage, along the shortest paths
+        ports = [0] + sorted({c[2] for c in problem.containers} - {0})
+        legs = [(_stowage_goal(problem, targets), _stowage_estimate(problem, targets))]
+        for port in ports[1:]:
+            legs.append((_leg_goal(problem, port), _leg_estimate(problem, port)))
+
+        for k, (goal, estimate) in enumerate(legs):
+            if k > 0:
+                node = _sail_path(problem, node, ports[k - 1], ports[k], type_h)
+                if node is None:
+                    break
+            leg = leg_search(problem, node, goal, estimate)
+            if leg is None:
+                node = None
+                break
+            node, expanded, peak = leg
+            expanded_nodes += expanded
+            peak_nodes = max(peak_nodes, peak)
+
+    if node is None:
+        return None
+
+    path = generate_path(node)
+    path[-1].h = init_h
+    return path, {"expanded_nodes": expanded_nodes, "peak_nodes": peak_nodes, "decomposed": True}
+
+
+def _sail_path(problem, node, origin_port, destination_port, type_h):
+    """ Sails from node along a shortest path of the route between the ports, returning the node at the destination
+    port or None if it cannot be reached """
+    distance = problem.port_distance
+    if distance[origin_port][destination_port] == float("inf"):
+        return None
+    port = origin_port
+    while port != destination_port:
+        next_port = next(p for p in problem.sail_ports[port]
+                         if distance[p][destination_port] == distance[port][destination_port] - 1)
+        node = _sail(problem, node, port, next_port, type_h)
+        port = next_port
+    return node
+
+
+def _stowage_goal(problem, targets):
+    """ Returns the goal of the leg of port 0: every container loaded in its target cell """
+    locations = [cell + problem.n_ports for cell in targets]
+
+    def goal(decoded):
+        return decoded[1:].tolist() == locations
+    return goal
+
+
+def _stowage_estimate(problem, targets):
+    """ Returns the heuristic of the leg of port 0: the load cost of the containers not in their target cell """
+    def estimate(decoded):
+        return sum(LOAD_COST * problem.cells[cell][0]
+                   for i, cell in enumerate(targets) if decoded[i + 1] != cell + problem.n_ports)
+    return estimate
+
+
+def _leg_goal(problem, port):
+    """ Returns the goal of the leg of port: its containers unloaded and the ones of later ports still on the ship """
+    def goal(decoded):
+        for i, c in enumerate(problem.containers):
+            if c[2] == port and decoded[i + 1] != port or c[2] > port and decoded[i + 1] < problem.n_ports:
+                return False
+        return True
+    return goal
+
+
+def _leg_estimate(problem, port):
+    """ Returns the heuristic of the leg of port: the unload cost of its containers still on the ship """
+    def estimate(decoded):
+        return sum(UNLOAD_COST * problem.cells[decoded[i + 1] - problem.n_ports][0]
+                   for i, c in enumerate(problem.containers) if c[2] == port and decoded[i + 1] >= problem.n_ports)
+    return estimate
+
+
+def presolve(problem, init_state, type_h, bounds=False):
+    """ Fast analysis of the problem before the search. Returns the reason why it has no plan, None if none was found,
+    and with bounds the lower bound of the cost, the best initial value of the admissible heuristics, and a plan
+    giving its upper bound, the one of the decomposed search or None. A problem is rejected when a container cannot
+    reach its destination along the route, when a container to move has no cell it can be loaded in and unloaded from
+    with enough other containers to support it, or when the admissible heuristics find no plan. Larger manifests than
+    the bay or its electrified cells are not rejected, since the ship can sail back and forth """
+    decoded = problem.decode(init_state)
+    distance = problem.port_distance
+    ship_port = decoded[0]
+    n_standard = sum(1 for c in problem.containers if not c[1])
+
+    for i, (container_id, refrigerated, destination) in enumerate(problem.containers):
+        location = decoded[i + 1]
+        if location == destination:
+            continue
+        if location >= problem.n_ports:
+            cell = location - problem.n_ports
+            stack, level = problem.cell_stack[cell]
+            if problem.stack_capped[stack] and level == len(problem.stacks[stack]) - 1:
+                return "Container %d is in a cell it can never be unloaded from" % container_id, None, None
+            port = ship_port
         else:
-            # generate the list of nodes that are the successors of current node
-            successors = generate_successors(current_node, type_h)
-
-            # update expanded_nodes
-            expanded_nodes += 1
-
-            # append current node to closed list
-            closed_nodes.append(current_node)
-
-            for n in successors:
-                # if n is not None
-                if n:
-                    # if the successor is not in open and not in closed
-                    if n not in open_nodes and n not in closed_nodes:
-                        # append in sorted way the successor
-                        open_nodes = sorted_append(n, open_nodes)
-
-                    # if the successor is in open and has lower cost
-                    elif n in open_nodes and lower_f(n, open_nodes):
-                        # delete node in open_nodes that has more cost
-                        discard_suc = open_nodes.index(n)
-                        open_nodes.pop(discard_suc)
-
-                        # append properly in the open list
-                        open_nodes = sorted_append(n, open_nodes)
-    return False
+            port = location
+            # the cells below the one it is loaded in hold other containers, the standard cells standard ones
+            others = len(problem.containers) - 1
+            others_standard = n_standard - (not refrigerated)
+            if not any(problem.cells[problem.stacks[stack][level]][2] or not refrigerated
+                       for stack, cells in enumerate(problem.stacks) for level in range(len(cells))
+                       if not (problem.stack_capped[stack] and level == len(cells) - 1) and level <= others
+                       and sum(not problem.cells[cell][2] for cell in cells[:level]) <= others_standard):
+                return "Container %d fits in no cell it can be unloaded from" % container_id, None, None
+        if distance[ship_port][port] + distance[port][destination] == float("inf"):
+            return "Container %d cannot reach port %d along the route" % (container_id, destination), None, None
+
+    # admissible heuristics never find a plan more expensive than the optimal one, an infinite value means no plan
+    lower_bound = 0
+    for name, heuristic in sorted(HEURISTICS.items()):
+        if heuristic.admissible and (bounds or name == "heuristic_3"):
+            lower_bound = max(lower_bound, heuristic_value(problem, init_state, name)[0])
+    if lower_bound == float("inf"):
+        return "The relaxed problems of the admissible heuristics have no plan", None, None
+    if not bounds:
+        return None, None, None
 
+    try:
+        upper = decomposed_plan(problem, init_state, type_h)
+    except ImportError:
+        # the part 1 model needs python-constraint
+        upper = None
+    return None, lower_bound, upper
+
+
+# formats of the plans and the suffix of their file
+PLAN_FORMATS = {"text": ".output", "jsonl": ".jsonl"}
+
+# nodes expanded by a worker of the parallel search before sending the successors owned by the other workers
+PARALLEL_BATCH = 32
+
+
+def parallel_search(problem, init_state, type_h, symmetry=True, workers=None):
+    """ Hash distributed A* (HDA*) over worker processes. Every state key is owned by one worker, chosen by its hash,
+    which keeps the open list and the table of the states it owns, expands them in f order and sends the successors
+    owned by the others through their queues, in batches. The cost of the best plan found so far is shared, and the
+    nodes whose f reaches it are pruned. The search ends when no worker has a node left to expand and no batch is in
+    transit, tracked by a shared counter of the busy workers and the undelivered batches. With an admissible heuristic
+    the plan is optimal, although ties between optimal plans may be broken differently from one run to another. The
+    plan is then rebuilt by following the concrete parent states of the goal through the workers owning them, so that
+    every action connects the state it was applied to with the next one even when symmetric states share a key """
+    n_workers = workers or os.cpu_count() or 1
+    state_key = problem.canonical_key if symmetry else _same_state
+    inboxes = [multiprocessing.Queue() for _ in range(n_workers)]
+    results = multiprocessing.Queue()
+    # busy workers plus batches sent and not processed yet
+    active = multiprocessing.Value("i", 0)
+    # cost of the best plan and worker owning its goal, written under the lock
+    incumbent = multiprocessing.RawValue("d", float("inf"))
+    goal_worker = multiprocessing.RawValue("i", -1)
+    lock = multiprocessing.Lock()
+
+    processes = [multiprocessing.Process(target=_parallel_worker, daemon=True,
+                                         args=(i, problem, type_h, symmetry, inboxes, results, active, incumbent,
+                                               goal_worker, lock, (HEURISTIC_CHECK, PATTERN_DIRECTORY)))
+                 for i in range(n_workers)]
+    for process in processes:
+        process.start()
+    try:
+        with active.get_lock():
+            active.value += 1
+        init_key = state_key(init_state)
+        inboxes[zlib.crc32(init_key) % n_workers].put(("nodes", [(init_key, 0, init_state, None, None)]))
+        while active.value:
+            if not all(process.is_alive() for process in processes):
+                raise Exception("A worker of the parallel search failed")
+            time.sleep(0.001)
+
+        # (state, g, parent state, action) of the nodes of the plan, from the goal to the initial node
+        entries = []
+        if goal_worker.value >= 0:
+            inboxes[goal_worker.value].put(("goal",))
+            state = results.get()[1]
+            while state is not None:
+                inboxes[zlib.crc32(state_key(state)) % n_workers].put(("lookup", state))
+                entries.append((state,) + results.get()[1:])
+                state = entries[-1][2]
+
+        for inbox in inboxes:
+            inbox.put(("stop",))
+        # (expanded nodes, stored nodes) of every worker
+        counts = [None] * n_workers
+        for _ in range(n_workers):
+            message = results.get()
+            counts[message[1]] = message[2:]
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    if not entries:
+        return False
+    node = None
+    for state, g, parent_state, action in reversed(entries):
+        parent, node = node, Node(state)
+        node.g, node.parent, node.action = g, parent, action
+        if parent is None:
+            calculate_heuristic(problem, node, type_h)
+    return generate_path(node), {"expanded_nodes": sum(c[0] for c in counts), "peak_nodes": sum(c[1] for c in counts),
+                                 "worker_expanded_nodes": [c[0] for c in counts]}
+
+
+def _parallel_worker(index, problem, type_h, symmetry, inboxes, results, active, incumbent, goal_worker, lock,
+                     settings):
+    """ Worker of the parallel search, serving the messages of its inbox: ("nodes", [(key, g, state, parent state,
+    action), ...]) to insert in its open list, ("goal",) and ("lookup", state) to rebuild the plan, and ("stop",), which
+    is answered with its counters """
+    global HEURISTIC_CHECK, PATTERN_DIRECTORY
+    HEURISTIC_CHECK, PATTERN_DIRECTORY = settings
+    state_key = problem.canonical_key if symmetry else _same_state
+    n_workers = len(inboxes)
+    inbox = inboxes[index]
+    # [g, h, state, closed] by state key
+    table = {}
+    # (g, parent state, action) by concrete state, for every state that was inserted, with the exact state it was
+    # generated from, which the table may have replaced by a symmetric one of its key
+    parents = {}
+    open_nodes = []
+    counter = itertools.count()
+    outgoing = [[] for _ in range(n_workers)]
+    busy = False
+    goal_state = None
+    expanded_nodes = 0
 
-def statistics_output(overall_time, solution, file_path, map_name, containers_name, h_type):
-    """Save the statistics on a txt file"""
-    # create the file and write in it
-    file = open(file_path + "/" + map_name + "-" + containers_name + "-" + h_type + ".stat", "w+")
-    file.truncate()
+    def insert(key, g, state, parent_state, action):
+        """ Pushes a node in the open list unless its state was reached with no higher g or its f reaches the best
+        plan, reopening the state if it was expanded """
+        entry = table.get(key)
+        if entry is not None and entry[0] <= g:
+            return
+        h = entry[1] if entry is not None else heuristic_value(problem, state, type_h)[0]
+        if g + h >= incumbent.value:
+            return
+        table[key] = [g, h, state, False]
+        # the key was never reached with a g this low, so neither was this state and its record can be replaced
+        parents[state] = (g, parent_state, action)
+        heapq.heappush(open_nodes, (g + h, h, next(counter), key, g))
+
+    while True:
+        try:
+            message = inbox.get_nowait() if open_nodes else inbox.get(timeout=0.01)
+        except queue.Empty:
+            message = None
+
+        if message is not None:
+            if message[0] == "nodes":
+                if not busy:
+                    busy = True
+                    with active.get_lock():
+                        active.value += 1
+                for item in message[1]:
+                    insert(*item)
+                with active.get_lock():
+                    active.value -= 1
+            elif message[0] == "goal":
+                results.put(("goal", goal_state))
+            elif message[0] == "lookup":
+                results.put(("entry",) + parents[message[1]])
+            else:
+                results.put(("stop", index, expanded_nodes, len(table)))
+                return
+            continue
+
+        # expand a batch of nodes
+        expanded = 0
+        while open_nodes and expanded < PARALLEL_BATCH:
+            f, h, _, key, g = heapq.heappop(open_nodes)
+            entry = table[key]
+            # stale or already expanded
+            if entry[0] != g or entry[3]:
+                continue
+            if f >= incumbent.value:
+                # no other node of the open list can improve the best plan
+                open_nodes.clear()
+                break
+            entry[3] = True
+            node = Node(entry[2])
+            node.g = g
+            if check_goal(problem, node):
+                with lock:
+                    if g < incumbent.value:
+                        incumbent.value = g
+                        goal_worker.value = index
+                        goal_state = entry[2]
+                continue
+
+            expanded += 1
+            decoded, moves = successor_moves(problem, node)
+            for move in moves:
+                successor_key = state_key(move[1])
+                item = (successor_key, move[0], move[1], node.state, move_action(problem, decoded, move))
+                owner = zlib.crc32(successor_key) % n_workers
+                if owner == index:
+                    insert(*item)
+                else:
+                    outgoing[owner].append(item)
+        expanded_nodes += expanded
 
-    if isinstance(solution, tuple):
-        file.write("Overall time: %d\n" % overall_time)
-        file.write("Overall cost: %d\n" % solution[0][0].g)
-        file.write("Plan length: %d\n" % len(solution[0]))
-        file.write("Expanded nodes: %d\n" % solution[1])
+        for owner, items in enumerate(outgoing):
+            if items:
+                with active.get_lock():
+                    active.value += 1
+                inboxes[owner].put(("nodes", items))
+                outgoing[owner] = []
+        if busy and not open_nodes:
+            busy = False
+            with active.get_lock():
+                active.value -= 1
 
-    # if solution not found
-    else:
-        file.write("SOLUTION NOT FOUND")
-    file.close()
 
+SEARCH_ENGINES = {"astar": a_star_search, "idastar": ida_star_search, "anytime": anytime_search,
+                  "decomposed": decomposed_search, "parallel": parallel_search}
 
-def actions_output(solution, file_path, map_name, containers_name, heuristic_type):
-    """Save the actions and the nodes into a file"""
-    # open the output file
-    file = open(file_path + "/" + map_name + "-" + containers_name + "-" + heuristic_type + ".output", "w+")
-    file.truncate()
 
-    if isinstance(solution, tuple):
-        # traverse the list of the path from the end to the beginning
-        # the last node in the list is the initial, it is not taken into account when printing the result
-        current_index = len(solution[0]) - 2
+def generate_path(node):
+    """ Returns the path from the initial node to node, in the following way: the first node is node and the final one
+    is the initial node """
+    path = []
+    while node is not None:
+        path.append(node)
+        node = node.parent
+    return path
 
-        ind = 1
-        while current_index >= 0:
-            file.write(str(ind) + ". " + solution[0][current_index].action + "\n")
-            current_index -= 1
-            ind += 1
 
-    # if solution not found
-    else:
-        file.write("SOLUTION NOT FOUND")
+def statistics_output(overall_time, solution, file_path, map_name, containers_name, h_type, infeasible=None):
+    """Save the statistics on a txt file, with the reason why the problem has no plan when the presolve found it"""
+    # create the file and write in it
+    with open(file_path + "/" + map_name + "-" + containers_name + "-" + h_type + ".stat", "w") as file:
+
+        if isinstance(solution, tuple):
+            file.write("Overall time: %d\n" % overall_time)
+            file.write("Overall cost: %d\n" % solution[0][0].g)
+            file.write("Plan length: %d\n" % len(solution[0]))
+            file.write("Expanded nodes: %d\n" % solution[1]["expanded_nodes"])
+            file.write("Peak nodes: %d\n" % solution[1]["peak_nodes"])
+            if "generated_nodes" in solution[1]:
+                stats = solution[1]
+                file.write("Generated nodes: %d\n" % stats["generated_nodes"])
+                file.write("Duplicate nodes: %d\n" % stats["duplicate_nodes"])
+                file.write("Bound pruned nodes: %d\n" % stats["pruned_nodes"])
+                file.write("Reopened nodes: %d\n" % stats["reopened_nodes"])
+                for phase in SearchMonitor.PHASES:
+                    file.write("Time %s: %d\n" % (phase.replace("_", " "), stats["time_" + phase]))
+                if "peak_rss" in stats:
+                    file.write("Peak RSS: %.1f MB\n" % stats["peak_rss"])
+            if "bound" in solution[1]:
+                file.write("Suboptimality bound: %.4f\n" % solution[1]["bound"])
+                for i, (cost, bound, elapsed, expanded) in enumerate(solution[1]["solutions"], 1):
+                    file.write("Solution %d: cost %d, bound %.4f, time %d, expanded nodes %d\n"
+                               % (i, cost, bound, elapsed, expanded))
+            if "worker_expanded_nodes" in solution[1]:
+                workers = solution[1]["worker_expanded_nodes"]
+                file.write("Workers: %d\n" % len(workers))
+                file.write("Expanded nodes per worker: %s\n" % ", ".join(str(n) for n in workers))
+            if "lower_bound" in solution[1]:
+                file.write("Lower bound: %s\n" % solution[1]["lower_bound"])
+                file.write("Upper bound: %s\n" % solution[1]["upper_bound"])
+            if "decomposed" in solution[1]:
+                file.write("Decomposed: %s\n" % ("yes" if solution[1]["decomposed"] else "no, monolithic search"))
+            file.write("Initial heuristic: %d\n" % solution[0][-1].h)
+            file.write("Node memory: %d bytes\n" % node_footprint(solution[0][0]))
+
+        # if solution not found
+        else:
+            file.write("SOLUTION NOT FOUND")
+            if infeasible is not None:
+                file.write("\nInfeasible: %s\n" % infeasible)
 
-    file.close()
 
+def actions_output(solution, file_path, map_name, containers_name, heuristic_type, output_format="text"):
+    """Save the actions of the plan into a file, as text or as JSON lines"""
+    with open(file_path + "/" + map_name + "-" + containers_name + "-" + heuristic_type + PLAN_FORMATS[output_format],
+              "w") as file:
+        if output_format == "jsonl":
+            write_plan_jsonl(file, solution[0][0] if isinstance(solution, tuple) else None)
+        elif isinstance(solution, tuple):
+            write_plan(file, solution[0][0])
 
-def main():
-    # get the input arguments
-    file_path = sys.argv[1]
-    map_file = sys.argv[2]
-    containers_file = sys.argv[3]
-    heuristic_type = sys.argv[4]
+        # if solution not found
+        else:
+            file.write("SOLUTION NOT FOUND")
+
+
+def plan_actions(node):
+    """Returns the actions leading from the initial node to node in the order they are applied, following the parents
+    of node and keeping only their action tuples"""
+    actions = []
+    while node.parent is not None:
+        actions.append(node.action)
+        node = node.parent
+    actions.reverse()
+    return actions
+
+
+def write_plan(file, node):
+    """Writes the actions of the plan ending in node into the file, one per line"""
+    for ind, action in enumerate(plan_actions(node), 1):
+        file.write(str(ind) + ". " + format_action(action) + "\n")
+
+
+def write_plan_jsonl(file, node):
+    """Writes a JSON line telling whether a plan was found with its cost and length, followed by a JSON line per
+    action of the plan ending in node, None when there is no plan"""
+    if node is None:
+        file.write(json.dumps({"found": False}) + "\n")
+        return
+    actions = plan_actions(node)
+    file.write(json.dumps({"found": True, "cost": node.g, "actions": len(actions)}) + "\n")
+    for step, action in enumerate(actions, 1):
+        if action[0] == "sail":
+            record = {"step": step, "action": "sail", "from": action[1], "to": action[2]}
+        elif action[0] == "load":
+            record = {"step": step, "action": "load", "container": action[1], "cell": [action[2], action[3]]}
+        else:
+            record = {"step": step, "action": "unload", "container": action[1]}
+        file.write(json.dumps(record) + "\n")
+
+
+def anytime_output(file):
+    """Returns the on_solution function of the anytime search, which appends every improved plan with its cost and
+    sub-optimality bound to the open output file"""
+    def on_solution(path, stats):
+        cost, bound = stats["solutions"][-1][:2]
+        file.write("Plan %d (cost %d, bound %.4f):\n" % (len(stats["solutions"]), cost, bound))
+        write_plan(file, path[0])
+        file.flush()
+    return on_solution
+
+
+def build_parser():
+    """Returns the parser of the command line arguments"""
+    parser = argparse.ArgumentParser(description="A* planner for loading and unloading containers")
+    parser.add_argument("path", help="directory of the input files, where the output files are written")
+    parser.add_argument("map", help="name of the ship map file, without extension")
+    parser.add_argument("containers", help="name of the containers file, without extension")
+    parser.add_argument("heuristic", choices=sorted(HEURISTICS), help="heuristic of the A* search")
+    parser.add_argument("--route", help="route file, each line a chain of ports the ship can sail along both ways "
+                                        "(default a line of ports 0 - 1 - 2)")
+    parser.add_argument("--ports", type=int, help="number of ports of a line route 0 - 1 - ... instead of --route")
+    parser.add_argument("--no-symmetry", action="store_true",
+                        help="tell apart the states that only differ by swapping interchangeable containers or stacks")
+    parser.add_argument("--engine", choices=sorted(SEARCH_ENGINES), default="astar",
+                        help="search engine: astar (default), idastar, whose memory is bounded by --node-budget, "
+                             "anytime, which writes improved plans until it proves one optimal or reaches a limit, "
+                             "decomposed, which plans the voyage port by port from a stowage in unload order, or "
+                             "parallel, a hash distributed A* over --workers processes")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes of the parallel engine (default the number of CPUs)")
+    parser.add_argument("--node-budget", type=int, default=100000,
+                        help="max number of states kept by idastar to detect duplicates (default 100000)")
+    parser.add_argument("--weight", type=float, default=5.0,
+                        help="initial weight of the heuristic in the anytime engine (default 5)")
+    parser.add_argument("--weight-step", type=float, default=1.0,
+                        help="decrease of the weight after each plan of the anytime engine (default 1)")
+    parser.add_argument("--time-limit", type=float, help="seconds after which the anytime engine stops")
+    parser.add_argument("--max-expansions", type=int, help="expanded nodes after which the anytime engine stops")
+    parser.add_argument("--profile", action="store_true",
+                        help="count the generated, duplicate and reopened nodes and time every phase of the astar "
+                             "engine, written in the .stat file")
+    parser.add_argument("--trace", help="JSON lines file where the astar engine samples the open and closed sizes, "
+                                        "implies --profile")
+    parser.add_argument("--trace-every", type=int, default=1000,
+                        help="expanded nodes between the samples of --trace (default 1000)")
+    parser.add_argument("--progress", type=float,
+                        help="seconds between progress lines of the astar engine on stderr, implies --profile")
+    parser.add_argument("--format", choices=sorted(PLAN_FORMATS), default="text",
+                        help="format of the plan: text, one action per line (default), or jsonl, a JSON line with the "
+                             "cost and length of the plan and a JSON line per action. The anytime engine writes text")
+    parser.add_argument("--pattern-dir",
+                        help="directory where heuristic_4 saves its pattern database tables, memory mapped by later "
+                             "runs on the same bay shape and route (default computed in memory)")
+    parser.add_argument("--bounds", action="store_true",
+                        help="bound the cost before the search: the plan of the decomposed search is kept when it "
+                             "costs the lower bound of the admissible heuristics, otherwise the A* engine prunes the "
+                             "nodes above its cost with an admissible heuristic")
+    parser.add_argument("--check-heuristic", action="store_true",
+                        help="cross-check every incremental heuristic update against a full computation")
+    parser.add_argument("--cache", help="SQLite file of the results of previous runs, reused for the same map, "
+                                        "containers, route and options and not with --profile, --trace or --progress")
+    parser.add_argument("--cache-size", type=float, default=result_cache.DEFAULT_SIZE,
+                        help="MB after which the least recently used results leave the cache (default %d)"
+                             % result_cache.DEFAULT_SIZE)
+    return parser
+
+
+def cache_options(args, route):
+    """Returns the options of the arguments the result of a run depends on, besides the map and the containers. The
+    tie between the optimal plans of the parallel engine depends on its number of workers"""
+    options = {"heuristic": args.heuristic, "engine": args.engine, "symmetry": not args.no_symmetry,
+               "route": route.neighbours if route else None, "node_budget": args.node_budget, "weight": args.weight,
+               "weight_step": args.weight_step, "time_limit": args.time_limit, "max_expansions": args.max_expansions,
+               "bounds": args.bounds, "format": args.format}
+    if args.engine == "parallel":
+        options["workers"] = args.workers or os.cpu_count()
+    return options
+
+
+def write_cached(file_path, map_name, containers_name, heuristic_type, files, status):
+    """Writes the output files of a cached result, with the cache status at the end of the .stat file"""
+    for suffix, content in files.items():
+        with open(file_path + "/" + map_name + "-" + containers_name + "-" + heuristic_type + suffix, "w") as file:
+            file.write(content)
+            if suffix == ".stat":
+                file.write(("" if content.endswith("\n") else "\n") + "Cache: %s\n" % status)
+
+
+def run(args):
+    """Solves the problem given by the parsed arguments and saves the output files. Returns a summary of the search"""
+    global HEURISTIC_CHECK, PATTERN_DIRECTORY
+
+    file_path = args.path
+    map_file = args.map
+    containers_file = args.containers
+    heuristic_type = args.heuristic
+    HEURISTIC_CHECK = args.check_heuristic
+    PATTERN_DIRECTORY = args.pattern_dir
 
     # parsed the map of the ship and the containers lists
     ship_map = parse_map(file_path, map_file)
     list_containers = parse_containers(file_path, containers_file)
 
-    # generate the initial state
-    init_state = generate_initial(list_containers, ship_map)
-
-    # execute the A* algorithm
+    # ports of the voyage
+    route = None
+    if args.route:
+        route = stowage_model.load_route(args.route)
+    elif args.ports:
+        route = stowage_model.line_route(args.ports)
+
+    # generate the static problem and the initial state
+    problem = StowageProblem(ship_map, list_containers, route)
+    init_state = generate_initial(problem)
+
+    # a previous run of the same problem and options answers at once, unless the search itself is observed or its plan
+    # depends on the speed of the machine, as the one of the anytime engine stopped by a time limit
+    cache = None
+    if args.cache and not (args.profile or args.trace or args.progress) \
+            and not (args.engine == "anytime" and args.time_limit is not None):
+        cache = result_cache.ResultCache(args.cache, int(args.cache_size * 1024 * 1024))
+        key = result_cache.cache_key("astar", RESULT_VERSION, ship_map, list_containers, cache_options(args, route))
+        cached = cache.get(key)
+        if cached is not None:
+            cache.close()
+            summary, files = cached
+            write_cached(file_path, map_file, containers_file, heuristic_type, files, "hit")
+            summary["cache"] = "hit"
+            return summary
+
+    # execute the search algorithm, unless the problem is found to have no plan or a plan is found to be optimal
     start_t = time.time()
-    solution_search = a_star_search(init_state, heuristic_type)
+    infeasible, lower_bound, upper = presolve(problem, init_state, heuristic_type, args.bounds)
+    bound = float("inf")
+    # the anytime engine writes its plans as it finds them
+    anytime = False
+    if upper is not None and HEURISTICS[heuristic_type].admissible:
+        bound = upper[0][0].g
+    if infeasible is not None:
+        solution_search = False
+    elif upper is not None and upper[0][0].g == lower_bound:
+        solution_search = upper
+    elif args.engine == "idastar":
+        solution_search = ida_star_search(problem, init_state, heuristic_type, not args.no_symmetry, args.node_budget)
+    elif args.engine == "anytime":
+        anytime = True
+        with open(file_path + "/" + map_file + "-" + containers_file + "-" + heuristic_type + ".output", "w") as file:
+            solution_search = anytime_search(problem, init_state, heuristic_type, not args.no_symmetry, args.weight,
+                                             args.weight_step, args.time_limit, args.max_expansions,
+                                             anytime_output(file))
+            if not solution_search:
+                file.write("SOLUTION NOT FOUND")
+    elif args.engine == "decomposed":
+        solution_search = decomposed_search(problem, init_state, heuristic_type, not args.no_symmetry)
+    elif args.engine == "parallel":
+        solution_search = parallel_search(problem, init_state, heuristic_type, not args.no_symmetry, args.workers)
+    elif args.profile or args.trace or args.progress:
+        with open(args.trace, "w") if args.trace else open(os.devnull, "w") as trace:
+            monitor = SearchMonitor(trace if args.trace else None, args.trace_every,
+                                    sys.stderr if args.progress else None, args.progress or 1.0)
+            solution_search = a_star_search(problem, init_state, heuristic_type, not args.no_symmetry, monitor,
+                                            bound)
+    else:
+        solution_search = a_star_search(problem, init_state, heuristic_type, not args.no_symmetry, bound=bound)
+    if solution_search and lower_bound is not None:
+        solution_search[1]["lower_bound"] = lower_bound
+        solution_search[1]["upper_bound"] = upper[0][0].g if upper is not None else float("inf")
     end_t = time.time()
 
     # time in milliseconds
     overall_time = (end_t - start_t)*1000
 
     # save the outputs of the program
-    actions_output(solution_search, file_path, map_file, containers_file, heuristic_type)
-    statistics_output(overall_time, solution_search, file_path, map_file, containers_file, heuristic_type)
+    if not anytime:
+        actions_output(solution_search, file_path, map_file, containers_file, heuristic_type, args.format)
+    statistics_output(overall_time, solution_search, file_path, map_file, containers_file, heuristic_type, infeasible)
+
+    summary = {"time": overall_time, "found": isinstance(solution_search, tuple)}
+    if infeasible is not None:
+        summary["infeasible"] = infeasible
+    if summary["found"]:
+        summary["cost"] = solution_search[0][0].g
+        summary["plan_length"] = len(solution_search[0])
+        summary.update((k, v) for k, v in solution_search[1].items() if k != "solutions")
+
+    if cache is not None:
+        files = {}
+        for suffix in (".output" if anytime else PLAN_FORMATS[args.format], ".stat"):
+            with open(file_path + "/" + map_file + "-" + containers_file + "-" + heuristic_type + suffix) as file:
+                files[suffix] = file.read()
+        cache.put(key, summary, files)
+        cache.close()
+        write_cached(file_path, map_file, containers_file, heuristic_type, {".stat": files[".stat"]}, "miss")
+        summary["cache"] = "miss"
+    return summary
+
+
+def main(argv=None):
+    # get the input arguments
+    run(build_parser().parse_args(argv))
 
 
-main()
+if __name__ == "__main__":
+    main()
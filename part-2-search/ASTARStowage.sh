@@ -1,3 +1,3 @@
 #! /usr/bin/bash
 
-python3 ASTARStowage.py $1 $2 $3 $4
\ No newline at end of file
+python3 ASTARStowage.py "$@"
\ No newline at end of file
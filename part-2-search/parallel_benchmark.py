@@ -0,0 +1,49 @@
+""" Benchmark of the parallel engine against the serial A*: speedup and search overhead for every number of workers """
+# python parallel_benchmark.py ./ASTAR-tests map6 containers5 heuristic_3 --workers 1,2,4,8
+import argparse
+import time
+
+import ASTARStowage
+
+
+def timed(search, *args):
+    """ Returns the solution of the search and its time in milliseconds """
+    start_t = time.perf_counter()
+    solution = search(*args)
+    return solution, (time.perf_counter() - start_t) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speedup and search overhead of the parallel A* engine")
+    parser.add_argument("path", help="directory of the input files")
+    parser.add_argument("map", help="name of the ship map file, without extension")
+    parser.add_argument("containers", help="name of the containers file, without extension")
+    parser.add_argument("heuristic", choices=sorted(ASTARStowage.HEURISTICS), help="heuristic of the searches")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated numbers of workers (default 1,2,4)")
+    parser.add_argument("--no-symmetry", action="store_true", help="tell apart the symmetric states")
+    args = parser.parse_args()
+
+    problem = ASTARStowage.StowageProblem(ASTARStowage.parse_map(args.path, args.map),
+                                          ASTARStowage.parse_containers(args.path, args.containers))
+    init_state = ASTARStowage.generate_initial(problem)
+    symmetry = not args.no_symmetry
+
+    serial, serial_time = timed(ASTARStowage.a_star_search, problem, init_state, args.heuristic, symmetry)
+    if not serial:
+        raise Exception("The instance has no solution")
+    serial_expanded = serial[1]["expanded_nodes"]
+    print("Serial A*: cost %d, %d expanded nodes, %.0f ms" % (serial[0][0].g, serial_expanded, serial_time))
+
+    for workers in (int(w) for w in args.workers.split(",")):
+        # each run starts from a problem without the tables built by a previous one
+        problem.pattern_database = None
+        solution, parallel_time = timed(ASTARStowage.parallel_search, problem, init_state, args.heuristic, symmetry,
+                                        workers)
+        expanded = solution[1]["expanded_nodes"]
+        print("%d workers: cost %d, %d expanded nodes (overhead %.2fx), %.0f ms (speedup %.2fx)"
+              % (workers, solution[0][0].g, expanded, expanded / serial_expanded, parallel_time,
+                 serial_time / parallel_time))
+
+
+if __name__ == "__main__":
+    main()
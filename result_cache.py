@@ -0,0 +1,71 @@
+""" Persistent cache of the results of both solvers, in an SQLite file shared by all their runs """
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+
+# default size of the cache in MB
+DEFAULT_SIZE = 256
+# version of the layout of the stored results, bumped when it changes so that older results are never read
+CACHE_VERSION = 1
+
+
+def cache_key(solver, version, *parts):
+    """ Returns the key of a result: the hash of the solver, the version of its results and the parts of its input,
+    parsed models and options, which must be made of JSON types (tuples are taken as lists). A solver bumps its version
+    whenever the output of the same input can change, so that results of its older logic are not served """
+    text = json.dumps([CACHE_VERSION, solver, version] + list(parts), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """ Results by key, each one a summary of the run and the content of its output files. The least recently used
+    results are evicted when the cache grows over max_bytes """
+
+    def __init__(self, path, max_bytes=DEFAULT_SIZE * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # several workers of a batch may share the file, the writes wait for each other
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, used REAL NOT NULL, "
+                                "size INTEGER NOT NULL, summary TEXT NOT NULL, files BLOB NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, key):
+        """ Returns the summary and the {suffix: content} files of the result of key, or None if it is not cached """
+        row = self.connection.execute("SELECT summary, files FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self.connection:
+            self.connection.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), json.loads(zlib.decompress(row[1]).decode("utf-8"))
+
+    def put(self, key, summary, files):
+        """ Stores the summary and the {suffix: content} files of the result of key, evicting the least recently used
+        results while the cache is over its size. A result larger than the whole cache is not stored """
+        summary = json.dumps(summary)
+        files = zlib.compress(json.dumps(files).encode("utf-8"))
+        size = len(summary) + len(files)
+        if size > self.max_bytes:
+            return
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                    (key, time.time(), size, summary, files))
+            total = self.connection.execute("SELECT SUM(size) FROM results").fetchone()[0]
+            for old_key, old_size in self.connection.execute("SELECT key, size FROM results WHERE key != ? "
+                                                             "ORDER BY used", (key,)).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM results WHERE key = ?", (old_key,))
+                total -= old_size
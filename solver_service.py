@@ -0,0 +1,536 @@
+""" Resident solver service: solves the CSP and A* problems sent to a local HTTP API, over TCP or a Unix socket, with a
+pool of worker processes that keep the solvers imported and their per-bay structures across the requests """
+# python solver_service.py --port 8765 --workers 4 --cache service-cache.db
+# curl -s localhost:8765/solve -d '{"solver": "astar", "heuristic": "heuristic_3", "map": "N N\nE N\nX X\n",
+#                                   "containers": "1 S 1\n2 R 2\n"}'
+import argparse
+import asyncio
+import base64
+import collections
+import contextlib
+import http
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+import urllib.parse
+
+import batch_runner
+import result_cache
+import stowage_model
+
+# largest request body accepted, in bytes
+MAX_BODY = 16 * 1024 * 1024
+# seconds a worker has to answer once told to stop its request before it is replaced by a new one
+STOP_GRACE = 5.0
+# finished requests that can still be queried, the oldest ones are forgotten first
+KEPT_JOBS = 1000
+# number of last requests whose latencies make the percentiles of the metrics
+LATENCY_WINDOW = 1000
+# seconds of the recent throughput of the metrics
+THROUGHPUT_WINDOW = 60
+# pattern database tables a worker keeps across its requests before starting over
+WORKER_PATTERN_TABLES = 256
+
+# names of the input files of a request in its directory
+MAP_NAME = "map"
+CONTAINERS_NAME = "containers"
+ROUTE_FILE = "route.txt"
+
+# options naming files of the machine of the service, which only the service or the fields of the request set
+SERVICE_OPTIONS = {"astar": ("route", "trace", "pattern_dir", "cache"), "csp": ("cache",)}
+
+
+class RequestError(Exception):
+    """ Raised when a request is wrong, answered with a 400 status """
+
+
+def parse_options(solver, args):
+    """ Returns the arguments of the solver parsed as its command line, raising a RequestError with the message of the
+    parser when they are wrong """
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(messages), contextlib.redirect_stdout(messages):
+            return batch_runner.SOLVERS[solver].build_parser().parse_args(args)
+    except SystemExit:
+        lines = messages.getvalue().strip().splitlines()
+        # the last line of an argparse error is "<program>: error: <message>"
+        raise RequestError(lines[-1].split("error: ", 1)[-1] if lines else "Wrong options of the %s solver" % solver)
+
+
+def parse_request(payload):
+    """ Returns the instance of a request, a JSON object with the solver (astar or csp), the text of the map and
+    containers files, the heuristic of astar, an optional route text, the list of command line options of the solver
+    and an optional deadline in seconds. Wrong requests, including wrong files, raise a RequestError """
+    if not isinstance(payload, dict):
+        raise RequestError("The request must be a JSON object")
+    solver = payload.get("solver")
+    if solver not in batch_runner.SOLVERS:
+        raise RequestError("Unknown solver %r, expected one of %s" % (solver, ", ".join(sorted(batch_runner.SOLVERS))))
+
+    files = {}
+    for field, name, parse in (("map", MAP_NAME + ".txt", stowage_model.parse_bay),
+                               ("containers", CONTAINERS_NAME + ".txt", stowage_model.parse_manifest),
+                               ("route", ROUTE_FILE, stowage_model.parse_route)):
+        if field == "route" and payload.get(field) is None:
+            continue
+        if solver == "csp" and field == "route":
+            raise RequestError("The csp solver has no route")
+        if not isinstance(payload.get(field), str):
+            raise RequestError("The %s field must be the text of the %s file" % (field, field))
+        try:
+            parse(payload[field], field)
+        except Exception as ex:
+            raise RequestError(str(ex))
+        files[name] = payload[field]
+
+    options = payload.get("options", [])
+    if not isinstance(options, list) or not all(isinstance(option, str) for option in options):
+        raise RequestError("The options field must be a list of strings")
+    args = [".", MAP_NAME, CONTAINERS_NAME]
+    if solver == "astar":
+        if not isinstance(payload.get("heuristic"), str):
+            raise RequestError("The astar solver needs a heuristic")
+        args.append(payload["heuristic"])
+    args.extend(options)
+    parsed = parse_options(solver, args)
+    for option in SERVICE_OPTIONS[solver]:
+        if getattr(parsed, option) is not None:
+            raise RequestError("Option --%s is set by the service" % option.replace("_", "-"))
+    if solver == "astar" and parsed.engine == "parallel":
+        raise RequestError("The parallel engine cannot run in the workers of the service")
+
+    deadline = payload.get("deadline")
+    if deadline is not None and (isinstance(deadline, bool) or not isinstance(deadline, (int, float))
+                                 or deadline <= 0):
+        raise RequestError("The deadline must be a positive number of seconds")
+    return {"solver": solver, "args": args, "files": files, "deadline": deadline}
+
+
+def solve(job, cache, cache_size, pattern_dir):
+    """ Solves a request in the worker, in a temporary directory holding its input and output files. Returns the result
+    of batch_runner.run_instance with the content of the output files, as text or base64 when they are binary """
+    with tempfile.TemporaryDirectory(prefix="stowage-") as directory:
+        for name, text in job["files"].items():
+            with open(directory + "/" + name, "w", encoding="utf-8") as file:
+                file.write(text)
+        args = [directory] + job["args"][1:]
+        if ROUTE_FILE in job["files"]:
+            args += ["--route", directory + "/" + ROUTE_FILE]
+        if cache:
+            args += ["--cache", cache, "--cache-size", str(cache_size)]
+        if pattern_dir and job["solver"] == "astar":
+            args += ["--pattern-dir", pattern_dir]
+        # stops are only raised during the solver call: one that arrived during the setup is raised as it starts, and
+        # one arriving as it returns does not discard its result
+        result = None
+        try:
+            try:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+                result = batch_runner.run_instance({"solver": job["solver"], "args": args}, job["timeout"])
+            finally:
+                signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+        except batch_runner.InstanceTimeout:
+            if result is None:
+                result = {"status": "timeout"}
+
+        for field in ("path", "map", "containers"):
+            result.pop(field, None)
+        result["options"] = " ".join(job["args"][4 if job["solver"] == "astar" else 3:])
+        result["files"] = {}
+        for name in sorted(os.listdir(directory)):
+            if name in job["files"]:
+                continue
+            with open(directory + "/" + name, "rb") as file:
+                content = file.read()
+            try:
+                result["files"][name] = content.decode("utf-8")
+            except UnicodeDecodeError:
+                result.setdefault("files_base64", {})[name] = base64.b64encode(content).decode("ascii")
+    return result
+
+
+def worker_main(connection, memory_mb, cache, cache_size, pattern_dir):
+    """ Loop of a worker process: solves the requests of its pipe one at a time, keeping the solvers imported and the
+    pattern database tables of the bays it has seen. The service stops a request with SIGALRM, the signal of the time
+    limit of batch_runner """
+    batch_runner.init_worker(memory_mb)
+    # the service stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # stops stay pending everywhere but in the solver call of solve, so no answer is ever lost to one
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    batch_runner.ASTARStowage.PATTERN_TABLES = {}
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if len(batch_runner.ASTARStowage.PATTERN_TABLES) > WORKER_PATTERN_TABLES:
+            batch_runner.ASTARStowage.PATTERN_TABLES.clear()
+        connection.send(solve(job, cache, cache_size, pattern_dir))
+        # a stop that arrived after its request was done is dropped
+        signal.sigtimedwait({signal.SIGALRM}, 0)
+
+
+class Job:
+    """ Request of the service, from its arrival to its result. status is queued, running, or the status of the result:
+    ok, timeout, memory, error or cancelled """
+
+    def __init__(self, job_id, instance):
+        self.id = job_id
+        self.instance = instance
+        self.status = "queued"
+        self.result = None
+        self.arrived = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.deadline = None if instance["deadline"] is None else self.arrived + instance["deadline"]
+        self.timer = None
+        # why the request is being stopped while it runs: cancelled or timeout
+        self.stop = None
+        self.stop_requested = asyncio.Event()
+        self.done = asyncio.Event()
+
+    def remaining(self):
+        """ Returns the seconds left until the deadline, None without one """
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def report(self):
+        """ Returns the JSON object of the request: its status, its times in milliseconds and its result """
+        report = {"id": self.id, "solver": self.instance["solver"], "status": self.status}
+        if self.started is not None:
+            report["queue_time"] = (self.started - self.arrived)*1000
+        if self.finished is not None:
+            report["latency"] = (self.finished - self.arrived)*1000
+        if self.result is not None:
+            report.update((k, v) for k, v in self.result.items() if k != "status")
+        return report
+
+
+class Worker:
+    """ Worker process of the pool and the pipe of its requests """
+
+    def __init__(self, context, settings):
+        self.context = context
+        self.settings = settings
+        self.start()
+
+    def start(self):
+        parent, child = self.context.Pipe()
+        self.process = self.context.Process(target=worker_main, args=(child,) + self.settings, daemon=True)
+        self.process.start()
+        child.close()
+        self.connection = parent
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def readable(self):
+        """ Returns a future done when the pipe has an answer to read, or the worker died, until unwatch is called """
+        future = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().add_reader(self.connection.fileno(),
+                                              lambda: future.done() or future.set_result(True))
+        return future
+
+    def unwatch(self):
+        """ Stops watching the pipe, at once so that a new pipe of the worker may take the same descriptor """
+        asyncio.get_running_loop().remove_reader(self.connection.fileno())
+
+
+def percentiles(values):
+    """ Returns the mean, the 50th, 90th and 99th percentiles (nearest rank) and the max of the values """
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {"mean": sum(ordered) / len(ordered), "max": ordered[-1]}
+    for p in (50, 90, 99):
+        summary["p%d" % p] = ordered[max(0, -(-p * len(ordered) // 100) - 1)]
+    return summary
+
+
+class SolverService:
+    """ Queue of the requests and the pool of workers solving them, with their metrics. Requests wait in a first in
+    first out queue for a worker, and each one of them can be cancelled or have a deadline: a queued request is
+    answered at once, a running one is stopped in its worker, which is replaced when it does not stop in time """
+
+    def __init__(self, workers=None, memory_mb=None, cache=None, cache_size=result_cache.DEFAULT_SIZE,
+                 pattern_dir=None):
+        self.n_workers = workers or os.cpu_count()
+        self.settings = (memory_mb, cache and os.path.abspath(cache), cache_size,
+                         pattern_dir and os.path.abspath(pattern_dir))
+        self.workers = []
+        self.tasks = []
+        self.queue = None
+        self.jobs = {}
+        self.finished_ids = collections.deque()
+        self.ids = itertools.count(1)
+        self.started = time.monotonic()
+        self.counts = collections.Counter()
+        self.solver_counts = collections.Counter()
+        self.running = 0
+        self.restarts = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.queue_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self.run_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self.finish_times = collections.deque()
+
+    async def start(self):
+        """ Starts the workers, in fresh interpreters so that they share nothing with the event loop """
+        self.queue = asyncio.Queue()
+        context = multiprocessing.get_context("spawn")
+        for _ in range(self.n_workers):
+            worker = Worker(context, self.settings)
+            self.workers.append(worker)
+            self.tasks.append(asyncio.ensure_future(self._serve(worker)))
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for worker in self.workers:
+            worker.stop()
+
+    def submit(self, payload):
+        """ Queues the request of the payload and returns its job, raising a RequestError when it is wrong """
+        job = Job(str(next(self.ids)), parse_request(payload))
+        self.jobs[job.id] = job
+        if job.deadline is not None:
+            job.timer = asyncio.get_running_loop().call_later(job.instance["deadline"], self._expire, job)
+        self.queue.put_nowait(job)
+        return job
+
+    def cancel(self, job):
+        """ Cancels a queued or running request, a finished one is left as it is """
+        if job.status == "queued":
+            self._finish(job, {"status": "cancelled"})
+        elif job.status == "running" and job.stop is None:
+            job.stop = "cancelled"
+            job.stop_requested.set()
+
+    def _expire(self, job):
+        """ Answers a request still queued at its deadline, the running ones are stopped by their worker """
+        if job.status == "queued":
+            self._finish(job, {"status": "timeout"})
+
+    def _finish(self, job, result):
+        job.result = result
+        job.status = result["status"]
+        job.finished = time.monotonic()
+        if job.timer is not None:
+            job.timer.cancel()
+        self.counts[job.status] += 1
+        self.solver_counts[job.instance["solver"]] += 1
+        self.latencies.append((job.finished - job.arrived)*1000)
+        if job.started is not None:
+            self.queue_times.append((job.started - job.arrived)*1000)
+            self.run_times.append((job.finished - job.started)*1000)
+        self.finish_times.append(job.finished)
+        self.finished_ids.append(job.id)
+        if len(self.finished_ids) > KEPT_JOBS:
+            del self.jobs[self.finished_ids.popleft()]
+        job.done.set()
+
+    async def _serve(self, worker):
+        """ Solves the queued requests with the worker, one at a time """
+        while True:
+            job = await self.queue.get()
+            if job.status != "queued":
+                continue
+            job.status = "running"
+            job.started = time.monotonic()
+            self.running += 1
+            try:
+                result = await self._run(worker, job)
+            except Exception as ex:
+                # every request gets an answer, and a worker left dead takes no more requests
+                result = {"status": "error", "error": str(ex)}
+                if not worker.process.is_alive():
+                    worker.restart()
+                    self.restarts += 1
+            finally:
+                self.running -= 1
+            if job.stop is not None and result["status"] in ("timeout", "error"):
+                result["status"] = job.stop
+            self._finish(job, result)
+
+    async def _run(self, worker, job):
+        """ Sends the request to the worker and returns its answer. A worker found dead is replaced before the request
+        is sent. A cancelled request, or one past its deadline, is stopped with SIGALRM, and the worker is replaced when
+        it does not answer within STOP_GRACE seconds """
+        remaining = job.remaining()
+        if remaining is not None and remaining <= 0:
+            return {"status": "timeout"}
+        message = {"solver": job.instance["solver"], "args": job.instance["args"], "files": job.instance["files"],
+                   "timeout": remaining}
+        try:
+            worker.connection.send(message)
+        except (BrokenPipeError, EOFError, OSError):
+            # the worker died while idle, a new one takes the request
+            worker.restart()
+            self.restarts += 1
+            worker.connection.send(message)
+        readable = worker.readable()
+        stop = asyncio.ensure_future(job.stop_requested.wait())
+        try:
+            # the worker enforces the deadline itself, the grace covers the time it takes to answer
+            await asyncio.wait({readable, stop}, timeout=None if remaining is None else remaining + STOP_GRACE,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not readable.done():
+                if job.stop is None:
+                    job.stop = "timeout"
+                os.kill(worker.process.pid, signal.SIGALRM)
+                await asyncio.wait({readable}, timeout=STOP_GRACE)
+            worker.unwatch()
+            if not readable.done():
+                worker.restart()
+                self.restarts += 1
+                return {"status": job.stop}
+            try:
+                return worker.connection.recv()
+            except (EOFError, OSError):
+                worker.restart()
+                self.restarts += 1
+                return {"status": "error", "error": "The worker process died"}
+        finally:
+            readable.cancel()
+            stop.cancel()
+
+    def metrics(self):
+        """ Returns the metrics of the service: requests by status and solver, queue, throughput in requests per
+        second over the whole run and the last THROUGHPUT_WINDOW seconds, and latency, queue and run time percentiles
+        in milliseconds over the last LATENCY_WINDOW requests """
+        now = time.monotonic()
+        while self.finish_times and self.finish_times[0] < now - THROUGHPUT_WINDOW:
+            self.finish_times.popleft()
+        uptime = now - self.started
+        completed = sum(self.counts.values())
+        return {"uptime": uptime, "workers": self.n_workers, "running": self.running,
+                "queued": sum(1 for job in self.jobs.values() if job.status == "queued"),
+                "completed": completed, "requests": dict(self.counts), "solvers": dict(self.solver_counts),
+                "worker_restarts": self.restarts,
+                "throughput": {"overall": completed / uptime if uptime else 0.0,
+                               "recent": len(self.finish_times) / min(uptime, THROUGHPUT_WINDOW) if uptime else 0.0},
+                "latency": percentiles(self.latencies), "queue_time": percentiles(self.queue_times),
+                "run_time": percentiles(self.run_times)}
+
+    async def route(self, method, target, body):
+        """ Returns the status and the JSON object of the answer to an HTTP request """
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+
+        if method == "GET" and parts == ["health"]:
+            return 200, {"status": "ok"}
+        if method == "GET" and parts == ["metrics"]:
+            return 200, self.metrics()
+        if method == "POST" and parts in (["solve"], ["jobs"]):
+            try:
+                job = self.submit(json.loads(body or b"null"))
+            except ValueError:
+                return 400, {"error": "The request body must be JSON"}
+            except RequestError as ex:
+                return 400, {"error": str(ex)}
+            if parts == ["jobs"]:
+                return 202, job.report()
+            await job.done.wait()
+            return 200, job.report()
+        if len(parts) == 2 and parts[0] == "jobs" and method in ("GET", "DELETE"):
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return 404, {"error": "Unknown job %s" % parts[1]}
+            if method == "DELETE":
+                self.cancel(job)
+                # a running request answers once its worker has stopped it
+                await job.done.wait()
+            elif "wait" in query:
+                try:
+                    await asyncio.wait_for(job.done.wait(), float(query["wait"][0]))
+                except asyncio.TimeoutError:
+                    pass
+                except ValueError:
+                    return 400, {"error": "The wait must be a number of seconds"}
+            return 200, job.report()
+        return 404, {"error": "Unknown endpoint %s %s" % (method, url.path)}
+
+    async def handle(self, reader, writer):
+        """ Answers an HTTP/1.1 request of a connection, which is then closed """
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                status, answer = 413, {"error": "The request body is over %d bytes" % MAX_BODY}
+            else:
+                status, answer = await self.route(method, target, await reader.readexactly(length))
+        except (ValueError, asyncio.IncompleteReadError):
+            status, answer = 400, {"error": "Malformed HTTP request"}
+
+        data = json.dumps(answer).encode("utf-8")
+        writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                      "Connection: close\r\n\r\n" % (status, http.HTTPStatus(status).phrase, len(data)))
+                     .encode("latin-1") + data)
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve(args):
+    """ Runs the service until SIGINT or SIGTERM """
+    service = SolverService(args.workers, args.memory, args.cache, args.cache_size, args.pattern_dir)
+    await service.start()
+    if args.unix:
+        server = await asyncio.start_unix_server(service.handle, path=args.unix)
+        print("Serving on %s with %d workers" % (args.unix, service.n_workers), flush=True)
+    else:
+        server = await asyncio.start_server(service.handle, args.host, args.port)
+        print("Serving on http://%s:%d with %d workers" % (args.host, args.port, service.n_workers), flush=True)
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    async with server:
+        await stopped.wait()
+    await service.close()
+    if args.unix:
+        os.unlink(args.unix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local service solving CSP and A* requests with warm workers")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the HTTP API (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port of the HTTP API (default 8765)")
+    parser.add_argument("--unix", help="Unix socket of the HTTP API instead of the TCP address")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default the number of CPUs)")
+    parser.add_argument("--memory", type=int, help="memory limit of each worker process in MB")
+    parser.add_argument("--cache", help="SQLite result cache shared by all the requests, see --cache of the solvers")
+    parser.add_argument("--cache-size", type=float, default=result_cache.DEFAULT_SIZE,
+                        help="MB after which the least recently used results leave the cache (default %d)"
+                             % result_cache.DEFAULT_SIZE)
+    parser.add_argument("--pattern-dir", help="directory of the pattern database tables of heuristic_4, shared by "
+                                              "the workers (default kept in the memory of each worker)")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+""" Shared model of the stowage problems: the bay map and the container manifest, parsed and validated once for the CSP
+and the search parts """
+import collections
+import marshal
+import os
+
+# cell kinds of the bay map
+NORMAL = "N"
+ELECTRIFIED = "E"
+BLOCKED = "X"
+CELL_KINDS = frozenset((NORMAL, ELECTRIFIED, BLOCKED))
+
+# files from this size on keep a binary copy of their parsed model next to them
+CACHE_MIN_BYTES = 64 * 1024
+CACHE_SUFFIX = ".cache"
+CACHE_VERSION = 1
+
+Bay = collections.namedtuple("Bay", ["depth", "width", "cells", "usable", "electrified", "blocked", "stacks"])
+Bay.__doc__ = """ Bay map. cells are all the cells as (row, column, kind) in reading order, row 0 being the top one;
+usable are the N and E cells as (row, column) in the same order, electrified and blocked the sets of E and X cells, and
+stacks the runs of usable cells of every column, each one from the cell on an X or the floor upwards """
+
+Manifest = collections.namedtuple("Manifest", ["containers"])
+Manifest.__doc__ = """ List of containers as (id, refrigerated, destination) in the order of the file """
+
+Route = collections.namedtuple("Route", ["n_ports", "neighbours", "distance"])
+Route.__doc__ = """ Ports 0 to n_ports - 1 and the sails between them. neighbours are the sorted ports the ship can sail
+to from every port, and distance the least number of sails between every pair of ports, inf when unreachable """
+
+
+def _read(file_path):
+    """ Returns the whole content of a file """
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            return file.read()
+    except FileNotFoundError as ex:
+        raise Exception("Wrong path or file path") from ex
+
+
+def _load_cache(file_path, kind):
+    """ Returns the model cached for the file if it is still up to date, otherwise None """
+    try:
+        stat = os.stat(file_path)
+        with open(file_path + CACHE_SUFFIX, "rb") as file:
+            version, cached_kind, size, mtime, model = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if (version, cached_kind, size, mtime) != (CACHE_VERSION, kind, stat.st_size, stat.st_mtime_ns):
+        return None
+    return model
+
+
+def _save_cache(file_path, kind, model):
+    """ Saves the binary copy of the model of the file, silently skipped when the directory is read only """
+    stat = os.stat(file_path)
+    try:
+        with open(file_path + CACHE_SUFFIX, "wb") as file:
+            file.write(marshal.dumps((CACHE_VERSION, kind, stat.st_size, stat.st_mtime_ns, model)))
+    except OSError:
+        pass
+
+
+def _cached(file_path, kind, parse, cache):
+    """ Returns the parsed model of the file, through its binary copy for large files """
+    if cache is None:
+        cache = os.path.getsize(file_path) >= CACHE_MIN_BYTES if os.path.exists(file_path) else False
+    if cache:
+        model = _load_cache(file_path, kind)
+        if model is not None:
+            return model
+    model = parse(_read(file_path), file_path)
+    if cache:
+        _save_cache(file_path, kind, model)
+    return model
+
+
+def make_bay(rows):
+    """ Returns the bay of the rows of the map, each one a string of cell kinds """
+    cells = tuple((r, c, kind) for r, row in enumerate(rows) for c, kind in enumerate(row))
+    usable = tuple((r, c) for r, c, kind in cells if kind != BLOCKED)
+    usable_set = frozenset(usable)
+
+    stacks = []
+    for r, c in usable:
+        if (r + 1, c) not in usable_set:
+            stack = [(r, c)]
+            while (stack[-1][0] - 1, c) in usable_set:
+                stack.append((stack[-1][0] - 1, c))
+            stacks.append(tuple(stack))
+
+    return Bay(len(rows), len(rows[0]) if rows else 0, cells, usable,
+               frozenset((r, c) for r, c, kind in cells if kind == ELECTRIFIED),
+               frozenset((r, c) for r, c, kind in cells if kind == BLOCKED), tuple(stacks))
+
+
+def parse_bay(text, file_path="map"):
+    """ Returns the bay of the text of a map file: one row per line, with the cell kinds optionally separated by
+    spaces. Unknown cell kinds, ragged rows and blank lines between rows raise an exception with their line """
+    lines = text.splitlines()
+    while lines and not lines[-1].strip():
+        lines.pop()
+
+    rows = []
+    for line_number, line in enumerate(lines, 1):
+        row = "".join(line.split())
+        if not row:
+            raise Exception("Blank line %d in %s" % (line_number, file_path))
+        if not CELL_KINDS.issuperset(row):
+            bad = next(kind for kind in row if kind not in CELL_KINDS)
+            raise Exception("Wrong cell '%s' in line %d of %s" % (bad, line_number, file_path))
+        if rows and len(row) != len(rows[0]):
+            raise Exception("Wrong number of cells in line %d of %s: %d instead of %d"
+                            % (line_number, file_path, len(row), len(rows[0])))
+        rows.append(row)
+    if not rows:
+        raise Exception("Empty map " + file_path)
+    return make_bay(rows)
+
+
+def parse_manifest(text, file_path="containers"):
+    """ Returns the manifest of the text of a containers file: one "<id> <S|R> <destination>" line per container, with
+    integer ids and destination ports from 1 on. Wrong lines and repeated ids raise an exception with their line """
+    containers = []
+    ids = set()
+    for line_number, line in enumerate(text.splitlines(), 1):
+        tokens = line.split()
+        if not tokens:
+            continue
+        if len(tokens) != 3 or tokens[1] not in ("S", "R") or not tokens[0].isdigit() or not tokens[2].isdigit() \
+                or int(tokens[2]) < 1:
+            raise Exception("Wrong container in line %d of %s: %s" % (line_number, file_path, line.strip()))
+        container_id = int(tokens[0])
+        if container_id in ids:
+            raise Exception("Repeated container %d in line %d of %s" % (container_id, line_number, file_path))
+        ids.add(container_id)
+        containers.append((container_id, tokens[1] == "R", int(tokens[2])))
+    return Manifest(tuple(containers))
+
+
+def make_route(n_ports, edges):
+    """ Returns the route of n_ports ports with sails both ways along the (port, port) edges, computing the distances
+    between all the ports once with a breadth first search from each one """
+    neighbours = [set() for _ in range(n_ports)]
+    for a, b in edges:
+        if a == b:
+            continue
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+    neighbours = tuple(tuple(sorted(n)) for n in neighbours)
+
+    distance = []
+    for origin in range(n_ports):
+        row = [float("inf")] * n_ports
+        row[origin] = 0
+        frontier = [origin]
+        while frontier:
+            next_frontier = []
+            for port in frontier:
+                for n in neighbours[port]:
+                    if row[n] == float("inf"):
+                        row[n] = row[port] + 1
+                        next_frontier.append(n)
+            frontier = next_frontier
+        distance.append(tuple(row))
+    return Route(n_ports, neighbours, tuple(distance))
+
+
+def line_route(n_ports):
+    """ Returns the route calling at ports 0, 1, ..., n_ports - 1 in a line, sailing between consecutive ports """
+    return make_route(n_ports, [(p, p + 1) for p in range(n_ports - 1)])
+
+
+def parse_route(text, file_path="route"):
+    """ Returns the route of the text of a route file: every line is a chain of ports "<port> <port> ...", with sails
+    both ways between consecutive ports. Ports are integers from 0 on, and the route has as many ports as the highest
+    one plus one. Wrong ports raise an exception with their line """
+    edges = []
+    n_ports = 1
+    for line_number, line in enumerate(text.splitlines(), 1):
+        tokens = line.split("#")[0].split()
+        if not tokens:
+            continue
+        if not all(t.isdigit() for t in tokens) or len(tokens) < 2:
+            raise Exception("Wrong route in line %d of %s: %s" % (line_number, file_path, line.strip()))
+        ports = [int(t) for t in tokens]
+        edges.extend(zip(ports, ports[1:]))
+        n_ports = max(n_ports, max(ports) + 1)
+    return make_route(n_ports, edges)
+
+
+def load_route(file_path):
+    """ Returns the route of a route file """
+    return parse_route(_read(file_path), file_path)
+
+
+def load_bay(file_path, cache=None):
+    """ Returns the bay of a map file. cache tells whether to go through its binary copy, by default only for large
+    files """
+    return Bay._make(_cached(file_path, "bay", lambda text, path: tuple(parse_bay(text, path)), cache))
+
+
+def load_manifest(file_path, cache=None):
+    """ Returns the manifest of a containers file. cache tells whether to go through its binary copy, by default only
+    for large files """
+    return Manifest._make(_cached(file_path, "manifest", lambda text, path: tuple(parse_manifest(text, path)), cache))